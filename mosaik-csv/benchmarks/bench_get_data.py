@@ -0,0 +1,66 @@
+"""
+Measure the cost of CSV.step() and CSV.get_data() for growing numbers of
+entities.
+
+Usage::
+
+    $ python benchmarks/bench_get_data.py
+
+"""
+import os
+import tempfile
+import timeit
+
+import mosaik_csv
+
+
+ENTITIES = [10, 100, 1000, 10000]
+ROWS = 100
+
+
+def write_csv(path, num_entities, wide):
+    with open(path, 'w') as f:
+        f.write('Model\n')
+        if wide:
+            f.write('Date,%s\n' % ','.join('P.E_%s,Q.E_%s' % (i, i)
+                                           for i in range(num_entities)))
+            cols = 2 * num_entities
+        else:
+            f.write('Date,P,Q\n')
+            cols = 2
+        for t in range(ROWS):
+            f.write('2014-01-01 %02d:%02d:00,%s\n' % (
+                t // 60, t % 60, ','.join(str(t + c) for c in range(cols))))
+
+
+def bench(tmpdir, num_entities, wide):
+    path = os.path.join(tmpdir, 'bench_%s_%s.csv' % (num_entities, wide))
+    write_csv(path, num_entities, wide)
+    sim = mosaik_csv.CSV()
+    sim.init('sid', 60., sim_start='2014-01-01 00:00:00', datafile=path,
+             preload=True, entity_sep='.' if wide else None)
+    entities = sim.create(num_entities, 'Model')
+    outputs = {e['eid']: ['P', 'Q'] for e in entities}
+
+    time = 0
+    def step():
+        nonlocal time
+        time = sim.step(time, {}, ROWS)
+        sim.get_data(outputs)
+
+    number = ROWS - 1
+    return timeit.timeit(step, number=number) / number
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print('%10s %15s %15s' % ('entities', 'shared [ms]', 'wide [ms]'))
+        for num_entities in ENTITIES:
+            print('%10d %15.3f %15.3f' % (
+                num_entities,
+                bench(tmpdir, num_entities, False) * 1000,
+                bench(tmpdir, num_entities, True) * 1000))
+
+
+if __name__ == '__main__':
+    main()
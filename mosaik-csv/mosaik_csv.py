@@ -1,9 +1,699 @@
+import datetime
+import functools
+import glob
+import hashlib
+import io
+import json
+import logging
+import operator
+import os
+import queue
+import re
+import threading
+
 import arrow
+import numpy as np
 
 import mosaik_api
 
 
-__version__ = '1.2.0'
+__version__ = '1.3.0'
+logger = logging.getLogger('mosaik_csv')
+
+# Size of the file region that _find_offset() scans linearly
+_SEEK_BLOCK = 1 << 16
+
+# Size of the read buffer for compressed files
+_READ_BUFFER = 1 << 20
+
+# Magic bytes and file extensions of supported compression formats
+_COMPRESSION_MAGIC = [
+    (b'\x1f\x8b', 'gzip'),
+    (b'\xfd7zXZ\x00', 'lzma'),
+    (b'\x5d\x00\x00', 'lzma'),
+    (b'BZh', 'bz2'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+]
+_COMPRESSION_EXTENSIONS = {
+    '.gz': 'gzip',
+    '.xz': 'lzma',
+    '.lzma': 'lzma',
+    '.bz2': 'bz2',
+    '.zst': 'zstd',
+}
+
+# File extensions of Parquet files, which are read with pyarrow
+_PARQUET_EXTENSIONS = ('.parquet', '.pq')
+
+# Divisors that convert Arrow timestamps to epoch seconds
+_TIMESTAMP_UNITS = {'s': 1, 'ms': 10**3, 'us': 10**6, 'ns': 10**9}
+
+# Ordinal of 1970-01-01, used to convert dates to UTC epoch seconds
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+# Splits an arrow format string into tokens and literals ("[...]" escapes)
+_FORMAT_TOKENS = re.compile(r'(\[(?:(?!\]).)*\]|YYY?Y?|MM?M?M?|Do|DD?D?D?|'
+                            r'd?dd?d?|HH?|hh?|mm?|ss?|SS?S?S?S?S?|ZZ?Z?|'
+                            r'[A-Za-z])')
+
+# Fixed-width arrow tokens that can be read by slicing the string
+_SLICE_TOKENS = {
+    'YYYY': ('year', 4),
+    'MM': ('month', 2),
+    'DD': ('day', 2),
+    'HH': ('hour', 2),
+    'mm': ('minute', 2),
+    'ss': ('second', 2),
+}
+
+# Arrow tokens with an equivalent strptime() directive
+_STRPTIME_TOKENS = {
+    'YYYY': '%Y',
+    'YY': '%y',
+    'MM': '%m',
+    'M': '%m',
+    'DDDD': '%j',
+    'DD': '%d',
+    'D': '%d',
+    'HH': '%H',
+    'H': '%H',
+    'mm': '%M',
+    'm': '%M',
+    'ss': '%S',
+    's': '%S',
+}
+
+
+def compile_date_format(date_format):
+    """Return a parser that converts date strings formatted like
+    *date_format* to UTC epoch seconds (:class:`int`).
+
+    *date_format* is an arrow format string or a list of them (which are
+    tried in order, like :func:`arrow.get()` does).  Formats that only
+    consist of fixed-width numeric fields (e.g., ``YYYY-MM-DD HH:mm:ss``) are
+    read by slicing the string, other numeric formats are handed to
+    :meth:`datetime.datetime.strptime()`.  Arrow is only used for formats
+    that neither of them can handle.
+
+    The parser raises a :exc:`ValueError` if a string does not match.
+
+    """
+    if not isinstance(date_format, str):
+        return _FirstMatchParser([compile_date_format(f)
+                                  for f in date_format])
+
+    tokens, literals = _split_format(date_format)
+    if (all(t in _SLICE_TOKENS for t in tokens) and
+            len(set(tokens)) == len(tokens) and
+            {'YYYY', 'MM', 'DD'} <= set(tokens)):
+        return _SliceParser(tokens, literals)
+    if all(t in _STRPTIME_TOKENS for t in tokens):
+        literals = [lit.replace('%', '%%') for lit in literals]
+        fmt = literals[0] + ''.join(_STRPTIME_TOKENS[t] + lit
+                                    for t, lit in zip(tokens, literals[1:]))
+        return _StrptimeParser(fmt)
+    return _ArrowParser(date_format)
+
+
+def _split_format(date_format):
+    """Split the arrow format string *date_format* into a list of tokens and
+    a list of the literal strings around them (which is one item longer).
+
+    """
+    tokens = []
+    literals = ['']
+    for i, part in enumerate(_FORMAT_TOKENS.split(date_format)):
+        if i % 2 == 0:
+            literals[-1] += part
+        elif part.startswith('['):
+            literals[-1] += part[1:-1]
+        else:
+            tokens.append(part)
+            literals.append('')
+    return tokens, literals
+
+
+class _SliceParser:
+    """Read fixed-width date fields at fixed offsets.
+
+    Consecutive rows of a time series usually share their date and only
+    differ in the time of day, so the offset of the day is remembered and
+    only recomputed when the date part of the string changes.
+
+    """
+    def __init__(self, tokens, literals):
+        self.offsets = {}
+        self.literals = [(0, literals[0])]
+        pos = len(literals[0])
+        for token, lit in zip(tokens, literals[1:]):
+            name, width = _SLICE_TOKENS[token]
+            self.offsets[name] = slice(pos, pos + width)
+            self.literals.append((pos + width, lit))
+            pos += width + len(lit)
+        self.literals = [(p, lit) for p, lit in self.literals if lit]
+        self.length = pos
+        self.time_fields = [(self.offsets[name], limit, factor)
+                            for name, limit, factor in (('hour', 24, 3600),
+                                                        ('minute', 60, 60),
+                                                        ('second', 60, 1))
+                            if name in self.offsets]
+
+        # The date can only be cached by prefix if it precedes the time
+        date_end = max(self.offsets[n].stop for n in ('year', 'month', 'day'))
+        time_start = min([f[0].start for f in self.time_fields] or [pos])
+        self.date_end = date_end if date_end <= time_start else None
+        self._day_key = None
+        self._day_seconds = None
+
+    def __call__(self, string):
+        string = string.strip()
+        if len(string) != self.length or any(
+                string[p:p + len(lit)] != lit for p, lit in self.literals):
+            raise ValueError('"%s" does not match the date format.' % string)
+
+        if self.date_end is not None and \
+                string[:self.date_end] == self._day_key:
+            seconds = self._day_seconds
+        else:
+            o = self.offsets
+            date = datetime.date(self._field(string, o['year']),
+                                 self._field(string, o['month']),
+                                 self._field(string, o['day']))
+            seconds = (date.toordinal() - _EPOCH_ORDINAL) * 86400
+            if self.date_end is not None:
+                self._day_key = string[:self.date_end]
+                self._day_seconds = seconds
+
+        for field, limit, factor in self.time_fields:
+            val = self._field(string, field)
+            if not 0 <= val < limit:
+                raise ValueError('"%s" does not match the date format.' %
+                                 string)
+            seconds += val * factor
+        return seconds
+
+    @staticmethod
+    def _field(string, field):
+        # int() would also accept signs and blanks
+        value = string[field]
+        if not value.isdigit():
+            raise ValueError('"%s" does not match the date format.' % string)
+        return int(value)
+
+
+class _StrptimeParser:
+    """Parse dates with :meth:`datetime.datetime.strptime()`."""
+    def __init__(self, fmt):
+        self.fmt = fmt
+
+    def __call__(self, string):
+        date = datetime.datetime.strptime(string.strip(), self.fmt)
+        return ((date.toordinal() - _EPOCH_ORDINAL) * 86400 +
+                date.hour * 3600 + date.minute * 60 + date.second)
+
+
+class _ArrowParser:
+    """Parse dates with :func:`arrow.get()`."""
+    def __init__(self, date_format):
+        self.date_format = date_format
+
+    def __call__(self, string):
+        return arrow.get(string, self.date_format).int_timestamp
+
+
+class _FirstMatchParser:
+    """Return the result of the first parser that accepts a string."""
+    def __init__(self, parsers):
+        self.parsers = parsers
+
+    def __call__(self, string):
+        for parser in self.parsers:
+            try:
+                return parser(string)
+            except ValueError:
+                pass
+        raise ValueError('"%s" does not match any date format.' % string)
+
+
+def get_compression(path):
+    """Return the compression format of the file *path* (``'gzip'``,
+    ``'lzma'``, ``'bz2'`` or ``'zstd'``) or ``None`` if it is not compressed.
+
+    The format is detected by the file's magic bytes or, if they are not
+    known, by its extension.
+
+    """
+    with open(path, 'rb') as f:
+        head = f.read(6)
+    for magic, compression in _COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return compression
+    return _COMPRESSION_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def open_datafile(path):
+    """Open the (possibly compressed) text file *path* for reading.
+
+    Compressed files are decompressed while they are read.  The decompressed
+    data is buffered in large chunks, so that iterating over lines does not
+    call the decompressor for every line.
+
+    """
+    compression = get_compression(path)
+    if compression is None:
+        return open(path)
+
+    if compression == 'gzip':
+        import gzip
+        stream = gzip.open(path)
+    elif compression == 'lzma':
+        import lzma
+        stream = lzma.open(path)
+    elif compression == 'bz2':
+        import bz2
+        stream = bz2.open(path)
+    else:
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('Reading "%s" requires the "zstandard" '
+                              'package.' % path) from None
+        stream = zstandard.ZstdDecompressor().stream_reader(
+            open(path, 'rb'), read_size=_READ_BUFFER, closefd=True)
+    return io.TextIOWrapper(io.BufferedReader(stream, _READ_BUFFER))
+
+
+def _expand_datafile(datafile):
+    """Return the list of files for *datafile*, which is a path, a glob
+    pattern or a list of them."""
+    if isinstance(datafile, str):
+        datafile = [datafile]
+    paths = []
+    for pattern in datafile:
+        if re.search(r'[*?[]', pattern):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise FileNotFoundError('No files match "%s".' % pattern)
+            paths.extend(matches)
+        else:
+            paths.append(pattern)
+    if not paths:
+        raise ValueError('No data file given.')
+    return paths
+
+
+def _read_header(f, delimiter):
+    """Read the model name and the attribute names from the file *f*."""
+    modelname = next(f).strip()
+
+    # Get attribute names and strip optional comments
+    attrs = next(f).strip().split(delimiter)[1:]
+    for i, attr in enumerate(attrs):
+        try:
+            # Try stripping comments
+            attr = attr[:attr.index('#')]
+        except ValueError:
+            pass
+        attrs[i] = attr.strip()
+    return modelname, attrs
+
+
+class _DataFiles:
+    """Iterate over the data rows of one or more CSV files.
+
+    All files need to have the same header.  They are read in the order of
+    their first date and only one of them is open at a time.
+
+    """
+    def __init__(self, paths, parse_date, delimiter):
+        self.delimiter = delimiter
+        self.first_dates = [None]
+        if len(paths) > 1:
+            headers = []
+            first_dates = []
+            for path in paths:
+                with open_datafile(path) as f:
+                    headers.append(_read_header(f, delimiter))
+                    row = next(f, '').strip()
+                first_dates.append(parse_date(row.split(delimiter)[0])
+                                   if row else None)
+            for path, header in zip(paths, headers):
+                if header != headers[0]:
+                    raise ValueError('Header of "%s" does not match the '
+                                     'header of "%s".' % (path, paths[0]))
+
+            # Empty files are skipped
+            order = sorted((date, i) for i, date in enumerate(first_dates)
+                           if date is not None)
+            paths = [paths[i] for _, i in order] or paths[:1]
+            self.first_dates = [date for date, _ in order] or [None]
+
+        self.paths = paths
+        self.file = None
+        self.idx = None
+        self.modelname = None
+        self.attrs = None
+        self.open(0)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            try:
+                return next(self.file)
+            except StopIteration:
+                if self.idx + 1 == len(self.paths):
+                    raise
+                self.open(self.idx + 1)
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def index(self, date):
+        """Return the index of the file that contains *date*."""
+        idx = 0
+        for i, first_date in enumerate(self.first_dates):
+            if first_date is not None and first_date <= date:
+                idx = i
+        return idx
+
+    def open(self, idx, offset=None):
+        """Close the current file and open the file *idx*.  Seek to
+        *offset* if it is given, else read the header."""
+        self.close()
+        self.file = open_datafile(self.paths[idx])
+        self.idx = idx
+        if offset is None:
+            self.modelname, self.attrs = _read_header(self.file,
+                                                      self.delimiter)
+        else:
+            self.file.seek(offset)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class _ParquetFiles:
+    """Read the data rows of one or more Parquet files.
+
+    The first column contains the dates (as timestamps, UTC epoch seconds or
+    strings in the date format), the other columns the attribute values.
+    Only the columns *attrs* are read (all numeric columns by default).  The
+    model name is taken from the ``model`` key of the schema metadata and
+    defaults to the name of the first file.
+
+    Row groups are only read when their date statistics overlap with the
+    requested date range, so seeking to the start date doesn't read the
+    rows before it.
+
+    """
+    def __init__(self, paths, parse_date, attrs=None, entity_sep=None):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Reading "%s" requires the "pyarrow" package.'
+                              % paths[0]) from None
+        import pyarrow.types
+
+        self.parquet = pyarrow.parquet
+        self.parse_date = parse_date
+        self.file = None
+
+        files = []
+        schema = None
+        for path in paths:
+            pf = self.parquet.ParquetFile(path)
+            try:
+                if schema is None:
+                    schema = pf.schema_arrow
+                    metadata = pf.schema_arrow.metadata or {}
+                elif pf.schema_arrow.names != schema.names:
+                    raise ValueError('Columns of "%s" do not match the '
+                                     'columns of "%s".' % (path, paths[0]))
+                groups = [self._date_range(pf.metadata.row_group(i))
+                          for i in range(pf.metadata.num_row_groups)]
+            finally:
+                pf.close()
+            files.append((path, groups))
+
+        if not schema.names:
+            raise ValueError('"%s" has no columns.' % paths[0])
+        self.date_column = schema.names[0]
+        self.date_type = schema.field(0).type
+        columns = schema.names[1:]
+        if attrs is None:
+            attrs = [name for name in columns if pyarrow.types.is_integer(
+                schema.field(name).type) or pyarrow.types.is_floating(
+                schema.field(name).type)]
+        else:
+            # In wide files, an attribute selects the columns of all entities
+            selected = set(attrs)
+            attrs = [name for name in columns if name in selected or (
+                entity_sep and name.partition(entity_sep)[0] in selected)]
+            missing = selected.difference(
+                name.partition(entity_sep)[0] if entity_sep else name
+                for name in attrs)
+            if missing:
+                raise ValueError('Columns %s not in "%s".' % (
+                    ', '.join(sorted(missing)), paths[0]))
+        self.attrs = attrs
+
+        model = metadata.get(b'model')
+        if model is not None:
+            self.modelname = model.decode()
+        else:
+            name = os.path.basename(paths[0])
+            self.modelname = name[:name.index('.')] if '.' in name else name
+
+        # Files with statistics are read in the order of their first date
+        def first_date(item):
+            dates = [lo for lo, _ in item[1] if lo is not None]
+            return min(dates) if dates else float('inf')
+        self.files = sorted(files, key=first_date) if len(files) > 1 else files
+        dates = [first_date(item) for item in self.files]
+        self.first_date = dates[0] if dates[0] != float('inf') else None
+
+        # Set by rows() if row groups before the start date were skipped
+        self.skipped = False
+
+    @property
+    def closed(self):
+        return self.file is None
+
+    def _date_range(self, row_group):
+        """Return the first and the last date of *row_group* or
+        ``(None, None)`` if its statistics are missing."""
+        stats = row_group.column(0).statistics
+        if stats is None or not stats.has_min_max:
+            return None, None
+        dates = []
+        for value in (stats.min, stats.max):
+            if isinstance(value, datetime.datetime):
+                if value.tzinfo is None:
+                    value = value.replace(tzinfo=datetime.timezone.utc)
+                value = value.timestamp()
+            elif not isinstance(value, int):
+                # Strings can't be compared without parsing them
+                return None, None
+            dates.append(value)
+        return tuple(dates)
+
+    def _groups(self, start, end):
+        """Yield the path and the indices of the row groups of each file
+        that may contain dates from *start* to (excluding) *end*."""
+        for path, groups in self.files:
+            indices = []
+            for i, (lo, hi) in enumerate(groups):
+                if hi is not None and hi < start:
+                    self.skipped = True
+                elif lo is not None and end is not None and lo >= end:
+                    pass
+                else:
+                    indices.append(i)
+            if indices:
+                yield path, indices
+
+    def _dates(self, column):
+        """Convert the date *column* of a record batch to epoch seconds."""
+        import pyarrow
+
+        if pyarrow.types.is_timestamp(self.date_type):
+            return (column.cast(pyarrow.int64()).to_numpy() //
+                    _TIMESTAMP_UNITS[self.date_type.unit])
+        if pyarrow.types.is_integer(self.date_type):
+            return column.to_numpy()
+        return np.array([self.parse_date(date)
+                         for date in column.to_pylist()], dtype=np.int64)
+
+    def _batches(self, start, end):
+        columns = [self.date_column] + self.attrs
+        for path, indices in self._groups(start, end):
+            self.file = self.parquet.ParquetFile(path)
+            try:
+                for batch in self.file.iter_batches(row_groups=indices,
+                                                    columns=columns):
+                    yield batch
+            finally:
+                self.close()
+
+    def rows(self, start, end=None):
+        """Return a function that returns the next row (its date and values)
+        from *start* on or ``None`` at the end of the data."""
+        def iter_rows():
+            for batch in self._batches(start, end):
+                dates = self._dates(batch.column(0)).tolist()
+                values = [batch.column(i).to_numpy(zero_copy_only=False)
+                          .astype(np.float64).tolist()
+                          for i in range(1, batch.num_columns)]
+                for row in zip(dates, *values):
+                    yield list(row)
+        return functools.partial(next, iter_rows(), None)
+
+    def load_columns(self, start, end=None):
+        """Return the dates and values of the rows from *start* to
+        (excluding) *end* as arrays."""
+        times = [np.empty(0, dtype=np.int64)]
+        values = [np.empty((0, len(self.attrs)))]
+        for batch in self._batches(start, end):
+            times.append(self._dates(batch.column(0)))
+            values.append(np.column_stack([
+                batch.column(i).to_numpy(zero_copy_only=False)
+                for i in range(1, batch.num_columns)]).astype(np.float64)
+                if self.attrs else np.empty((batch.num_rows, 0)))
+        return (np.concatenate(times).astype(np.int64),
+                np.concatenate(values))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def _row_reader(lines, parse_date, delimiter):
+    """Return a function that reads the next line from *lines* and returns
+    its date and values (or ``None`` at the end of the file)."""
+    def read_row():
+        try:
+            row = next(lines).strip().split(delimiter)
+        except StopIteration:
+            return None
+        row[0] = parse_date(row[0])
+        row[1:] = map(float, row[1:])
+        return row
+    return read_row
+
+
+def _read_until(read_row, end_date):
+    """Return a function that calls *read_row* but returns ``None`` for rows
+    at or after *end_date*."""
+    def read_until():
+        row = read_row()
+        if row is not None and row[0] >= end_date:
+            return None
+        return row
+    return read_until
+
+
+class _Resampler:
+    """Aggregate the rows returned by *read_row* over windows of *window*
+    seconds, beginning at *start*.
+
+    *how* is ``'mean'``, ``'last'`` or ``'max'``.  *first_row* is the row of
+    *read_row* that has already been read.  Each call returns the start date
+    of the next window with rows and the aggregated values of its rows.
+
+    """
+    def __init__(self, read_row, how, start, window, first_row):
+        self.read_row = read_row
+        self.how = how
+        self.start = start
+        self.window = window
+        self.pending = first_row
+
+    def __call__(self):
+        row = self.pending
+        if row is None:
+            return None
+
+        window_start = (self.start +
+                        (row[0] - self.start) // self.window * self.window)
+        window_end = window_start + self.window
+        values = row[1:]
+        count = 1
+        while True:
+            row = self.read_row()
+            if row is None or row[0] >= window_end:
+                break
+            if self.how == 'mean':
+                values = [a + b for a, b in zip(values, row[1:])]
+            elif self.how == 'max':
+                values = [max(a, b) for a, b in zip(values, row[1:])]
+            else:
+                values = row[1:]
+            count += 1
+        self.pending = row
+
+        if self.how == 'mean':
+            values = [val / count for val in values]
+        return [window_start] + values
+
+
+class _Prefetcher(threading.Thread):
+    """Call *read_row* on a background thread and keep up to *size* of its
+    results in a queue.
+
+    *read_row* returns ``None`` at the end of the file, which stops the
+    thread.  Exceptions are re-raised by :meth:`get()`.
+
+    """
+    def __init__(self, read_row, size):
+        super().__init__(name='mosaik_csv prefetcher', daemon=True)
+        self.read_row = read_row
+        self.queue = queue.Queue(size)
+        self.stopped = False
+
+    def run(self):
+        row = True
+        while row is not None and not self.stopped:
+            try:
+                row = self.read_row()
+            except Exception as e:
+                row = None
+                self.queue.put(e)
+            else:
+                self.queue.put(row)
+
+    def get(self):
+        """Return the next row (or ``None`` at the end of the file)."""
+        row = self.queue.get()
+        if isinstance(row, Exception):
+            raise row
+        return row
+
+    def stop(self):
+        """Stop the thread and wait for it to finish."""
+        self.stopped = True
+        while self.is_alive():
+            # Unblock the thread if it waits for space in the queue
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                self.join(.01)
+
+
+def _single_getter(col):
+    """Return a function that returns the value of column *col* of a row as
+    a one-tuple (:func:`operator.itemgetter()` would return a bare value)."""
+    def getter(row):
+        return (row[col],)
+    return getter
+
+
+def _no_values(row):
+    return ()
 
 
 class CSV(mosaik_api.Simulator):
@@ -12,35 +702,77 @@ class CSV(mosaik_api.Simulator):
         self.time_resolution = None
         self.start_date = None
         self.date_format = None
+        self.parse_date = None
         self.delimiter = None
-        self.datafile = 'tests/data/test.csv'
+        self.datafile = None
         self.next_row = None
         self.modelname = None
         self.attrs = None
+        self.entity_sep = None
+        self.columns = None
         self.eids = []
+        self.entities = {}
         self.cache = None
+        self._outputs = None
+        self._output_plan = None
+        self.preload = False
+        self.end_date = None
+        self.resample = None
+        self.window = None
+        self.read_row = None
+        self.prefetcher = None
+        self.times = None
+        self.values = None
+        self.row_idx = None
 
     def init(self, sid, time_resolution, sim_start, datafile, date_format='YYYY-MM-DD HH:mm:ss',
-             delimiter=','):
+             delimiter=',', preload=False, cache=False, cache_dir=None,
+             entity_sep=None, prefetch=0, sim_end=None, resample=None,
+             window=None, attrs=None):
+        if resample not in (None, 'mean', 'last', 'max'):
+            raise ValueError('Invalid resample method "%s".' % resample)
+        if resample and not window:
+            raise ValueError('Resampling requires a window.')
+
         self.time_resolution = float(time_resolution)
         self.delimiter = delimiter
+        self.entity_sep = entity_sep
         self.date_format = date_format
-        self.start_date = arrow.get(sim_start, self.date_format)
+        self.parse_date = compile_date_format(self.date_format)
+        self.start_date = self.parse_date(sim_start)
         self.next_date = self.start_date
+        if sim_end is not None:
+            self.end_date = self.parse_date(sim_end)
+        self.resample = resample
+        self.window = window
+        self.preload = preload or cache
 
-        self.datafile = open(datafile)
-        self.modelname = next(self.datafile).strip()
+        paths = _expand_datafile(datafile)
+        parquet = os.path.splitext(paths[0])[1].lower() in _PARQUET_EXTENSIONS
+        if parquet:
+            # Parquet files are already binary, so they need no cache
+            self.datafile = _ParquetFiles(paths, self.parse_date, attrs,
+                                          entity_sep)
+            self.modelname = self.datafile.modelname
+            self.attrs = self.datafile.attrs
+            if self.preload:
+                self.times, self.values = self.datafile.load_columns(
+                    self.start_date, self.end_date)
+        elif attrs is not None:
+            raise ValueError('Selecting attributes requires a Parquet file.')
+        elif cache:
+            self._load_cache(paths, cache_dir)
+        else:
+            self._open(paths)
+            if self.preload:
+                self._load_columns()
 
-        # Get attribute names and strip optional comments
-        attrs = next(self.datafile).strip().split(self.delimiter)[1:]
-        for i, attr in enumerate(attrs):
-            try:
-                # Try stripping comments
-                attr = attr[:attr.index('#')]
-            except ValueError:
-                pass
-            attrs[i] = attr.strip()
-        self.attrs = attrs
+        self.columns = self._map_columns()
+        if self.entity_sep is None:
+            attrs = list(self.columns[None])
+        else:
+            attrs = list(dict.fromkeys(attr for cols in self.columns.values()
+                                       for attr in cols))
 
         self.meta['type'] = 'time-based'
 
@@ -50,16 +782,56 @@ class CSV(mosaik_api.Simulator):
             'attrs': attrs,
         }
 
+        if self.preload:
+            self._seek_columns(self.datafile.first_date if parquet else None)
+            if self.resample:
+                self._resample_columns()
+            return self.meta
+
+        if parquet:
+            self.read_row = self.datafile.rows(self.start_date, self.end_date)
+            self._read_next_row()
+            first_row = not self.datafile.skipped
+        else:
+            # Jump to the first row at or after the start date.  Compressed
+            # files can't be searched and are read up to the start date
+            # instead.
+            idx = self.datafile.index(self.start_date)
+            path = self.datafile.paths[idx]
+            data_start = offset = None
+            if get_compression(path) is None:
+                data_start, offset = self._find_offset(path, self.start_date)
+            self.datafile.open(idx, offset)
+
+            self.read_row = _row_reader(self.datafile, self.parse_date,
+                                        self.delimiter)
+            self._read_next_row()
+            first_row = idx == 0 and offset == data_start
+
         # Check start date
-        self._read_next_row()
-        if self.start_date < self.next_row[0]:
+        while self.next_row is not None and \
+                self.start_date > self.next_row[0]:
+            self._read_next_row()
+            first_row = False
+        if self.next_row is None or (first_row and
+                                     self.start_date < self.next_row[0]):
+            self.datafile.close()
             raise ValueError('Start date "%s" not in CSV file.' %
-                             self.start_date.format(self.date_format))
-        while self.start_date > self.next_row[0]:
+                             self._format_date(self.start_date))
+
+        if self.end_date is not None:
+            self.read_row = _read_until(self.read_row, self.end_date)
+            if self.next_row[0] >= self.end_date:
+                self.next_row = None
+        if self.resample:
+            self.read_row = _Resampler(self.read_row, self.resample,
+                                       self.start_date, self.window,
+                                       self.next_row)
             self._read_next_row()
-            if self.next_row is None:
-                raise ValueError('Start date "%s" not in CSV file.' %
-                                 self.start_date.format(self.date_format))
+
+        if prefetch:
+            self.prefetcher = _Prefetcher(self.read_row, prefetch)
+            self.prefetcher.start()
 
         return self.meta
 
@@ -68,62 +840,312 @@ class CSV(mosaik_api.Simulator):
             raise ValueError('Invalid model "%s" % model')
 
         start_idx = len(self.eids)
+        if self.entity_sep is None:
+            eids = ['%s_%s' % (model, i + start_idx) for i in range(num)]
+        else:
+            eids = list(self.columns)[start_idx:start_idx + num]
+            if len(eids) < num:
+                raise ValueError('Cannot create %d entities, only %d left in '
+                                 'CSV file.' % (num, len(eids)))
+
         entities = []
-        for i in range(num):
-            eid = '%s_%s' % (model, i + start_idx)
+        for eid in eids:
             entities.append({
                 'eid': eid,
                 'type': model,
                 'rel': [],
             })
             self.eids.append(eid)
+            self.entities[eid] = self.columns[
+                None if self.entity_sep is None else eid]
         return entities
 
     def step(self, time, inputs, max_advance):
+        if self.preload:
+            return self._step_columns(time, max_advance)
+
         data = self.next_row
         if data is None:
             raise IndexError('End of CSV file reached.')
 
         # Check date
         date = data[0]
-        expected_date = self.start_date.shift(seconds=time*self.time_resolution)
+        expected_date = self.start_date + time*self.time_resolution
         if date != expected_date:
             raise IndexError('Wrong date "%s", expected "%s"' % (
-                date.format(self.date_format),
-                expected_date.format(self.date_format)))
+                self._format_date(date),
+                self._format_date(expected_date)))
 
         # Put data into the cache for get_data() calls
-        self.cache = {}
-        for attr, val in zip(self.attrs, data[1:]):
-            self.cache[attr] = float(val)
+        self.cache = data[1:]
 
         self._read_next_row()
         if self.next_row is not None:
-            return time + int((self.next_row[0].int_timestamp - date.int_timestamp)/self.time_resolution)
+            return time + int((self.next_row[0] - date)/self.time_resolution)
         else:
             return max_advance
 
     def get_data(self, outputs):
+        # mosaik usually requests the same outputs in every step, so the
+        # plan for building the response is only compiled when they change.
+        if outputs != self._outputs:
+            self._output_plan = self._compile_outputs(outputs)
+            self._outputs = {eid: list(attrs)
+                             for eid, attrs in outputs.items()}
+
+        row = self.cache
         data = {}
-        for eid, attrs in outputs.items():
-            if eid not in self.eids:
-                raise ValueError('Unknown entity ID "%s"' % eid)
+        for attrs, getter, eids in self._output_plan:
+            values = dict(zip(attrs, getter(row)))
+            for eid in eids:
+                data[eid] = values.copy()
+        return data
 
-            data[eid] = {}
-            for attr in attrs:
-                data[eid][attr] = self.cache[attr]
+    def _compile_outputs(self, outputs):
+        """Group the entities in *outputs* by the columns they request.
 
-        return data
+        Return a list of ``(attrs, getter, eids)`` tuples, where *getter*
+        returns the values of the attributes *attrs* from a cached row.
+
+        """
+        groups = {}
+        for eid, attrs in outputs.items():
+            try:
+                columns = self.entities[eid]
+            except KeyError:
+                raise ValueError('Unknown entity ID "%s"' % eid) from None
+            key = (tuple(attrs), tuple(columns[attr] for attr in attrs))
+            groups.setdefault(key, []).append(eid)
+
+        plan = []
+        for (attrs, cols), eids in groups.items():
+            if len(cols) == 1:
+                getter = _single_getter(cols[0])
+            elif cols:
+                getter = operator.itemgetter(*cols)
+            else:
+                getter = _no_values
+            plan.append((attrs, getter, eids))
+        return plan
 
     def _read_next_row(self):
+        if self.prefetcher is not None:
+            self.next_row = self.prefetcher.get()
+        else:
+            self.next_row = self.read_row()
+
+    def _map_columns(self):
+        """Return a dict mapping entity IDs to dicts that map attribute names
+        to column indices.
+
+        If :attr:`entity_sep` is set, columns are named
+        ``<attr><entity_sep><eid>`` and each entity gets its own columns.
+        Otherwise, all entities share all columns (stored under ``None``).
+
+        """
+        if self.entity_sep is None:
+            return {None: {attr: i for i, attr in enumerate(self.attrs)}}
+
+        columns = {}
+        for i, column in enumerate(self.attrs):
+            attr, sep, eid = column.partition(self.entity_sep)
+            if not sep:
+                raise ValueError('Column "%s" does not contain an entity ID.'
+                                 % column)
+            columns.setdefault(eid, {})[attr] = i
+        return columns
+
+    def _open(self, paths):
+        """Open the data files *paths* and read their header."""
+        self.datafile = _DataFiles(paths, self.parse_date, self.delimiter)
+        self.modelname = self.datafile.modelname
+        self.attrs = self.datafile.attrs
+
+    def _find_offset(self, datafile, date):
+        """Return the offset of the first data row in *datafile* and the
+        offset of the first row whose date is not before *date*.
+
+        The rows must be sorted by date.  The offset is found via binary
+        search over byte offsets, so only ``O(log n)`` dates are parsed.
+
+        """
+        delimiter = self.delimiter.encode()
+
+        def not_before(line):
+            # Blank lines only occur at the end of the file.
+            if not line.strip():
+                return True
+            return self.parse_date(line.split(delimiter)[0].decode()) >= date
+
+        with open(datafile, 'rb') as f:
+            f.readline()
+            f.readline()
+            lo = data_start = f.tell()
+            hi = f.seek(0, os.SEEK_END)
+
+            # Invariant: All rows before "lo" are before "date" and the
+            # wanted row starts no later than the first row after "hi".
+            while hi - lo > _SEEK_BLOCK:
+                mid = (lo + hi) // 2
+                f.seek(mid - 1)
+                f.readline()
+                pos = f.tell()
+                line = f.readline()
+                if not_before(line):
+                    hi = mid
+                else:
+                    lo = pos + len(line)
+
+            f.seek(lo)
+            for line in f:
+                if not_before(line):
+                    break
+                lo += len(line)
+
+        return data_start, lo
+
+    def _load_columns(self):
+        """Parse the remaining rows of :attr:`datafile` into :attr:`times`
+        (UTC epoch seconds) and :attr:`values` (one column per attribute)."""
+        parse_date = self.parse_date
+        times = []
+        values = []
+        for line in self.datafile:
+            row = line.strip().split(self.delimiter)
+            if row == ['']:
+                continue
+            times.append(parse_date(row[0]))
+            values.append(row[1:])
+        self.datafile.close()
+
+        self.times = np.array(times, dtype=np.int64)
+        self.values = np.array(values, dtype=np.float64).reshape(
+            len(times), len(self.attrs))
+
+    def _load_cache(self, paths, cache_dir):
+        """Memory-map the columns of the data files *paths* from binary
+        sidecar files in *cache_dir* (the directory of the first data file by
+        default).
+
+        The sidecar files are created if they don't exist yet.  Their name
+        contains a hash of the paths, modification times and sizes of the
+        data files as well as the date format and delimiter, so they are
+        rebuilt whenever one of them changes.
+
+        """
+        files = []
+        for path in paths:
+            stat = os.stat(path)
+            files.append((os.path.abspath(path), stat.st_mtime_ns,
+                          stat.st_size))
+        key = repr((files, self.date_format, self.delimiter))
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        path = files[0][0]
+        base = os.path.join(cache_dir or os.path.dirname(path), '%s.%s' % (
+            os.path.basename(path), digest))
+
         try:
-            self.next_row = next(self.datafile).strip().split(self.delimiter)
-            self.next_row[0] = arrow.get(self.next_row[0], self.date_format)
-        except StopIteration:
-            self.next_row = None
+            with open(base + '.json') as f:
+                header = json.load(f)
+            self.times = np.load(base + '.times.npy', mmap_mode='r')
+            self.values = np.load(base + '.values.npy', mmap_mode='r')
+        except (OSError, ValueError):
+            pass
+        else:
+            self.modelname = header['model']
+            self.attrs = header['attrs']
+            return
+
+        self._open(paths)
+        self._load_columns()
+        try:
+            # Write to temporary files and rename them, so that concurrent
+            # processes never see incomplete files.  The JSON header is
+            # written last and marks the cache as complete.
+            for suffix, array in [('.times.npy', self.times),
+                                  ('.values.npy', self.values)]:
+                tmp = '%s%s.%s.tmp' % (base, suffix, os.getpid())
+                with open(tmp, 'wb') as f:
+                    np.save(f, array)
+                os.replace(tmp, base + suffix)
+            tmp = '%s.json.%s.tmp' % (base, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump({'model': self.modelname, 'attrs': self.attrs}, f)
+            os.replace(tmp, base + '.json')
+        except OSError as e:
+            logger.warning('Could not write cache for "%s": %s' % (path, e))
+
+    def _seek_columns(self, first_date=None):
+        """Position :attr:`row_idx` at the start date.
+
+        *first_date* is the first date of the data file if :attr:`times`
+        doesn't start at it.
+
+        """
+        start = self.start_date
+        self.row_idx = int(np.searchsorted(self.times, start))
+        if first_date is None and len(self.times):
+            first_date = self.times[0]
+        if not len(self.times) or start < first_date or \
+                self.row_idx == len(self.times):
+            raise ValueError('Start date "%s" not in CSV file.' %
+                             self._format_date(start))
+
+        if self.end_date is not None:
+            stop = int(np.searchsorted(self.times, self.end_date))
+            self.times = self.times[:stop]
+            self.values = self.values[:stop]
+
+    def _resample_columns(self):
+        """Replace the rows from :attr:`row_idx` on with one row per window
+        of :attr:`window` seconds that contains rows."""
+        times = self.times[self.row_idx:]
+        if not len(times):
+            return
+        values = self.values[self.row_idx:]
+        windows = (times - self.start_date) // self.window
+        first = np.flatnonzero(np.diff(windows, prepend=-1))
+        if self.resample == 'mean':
+            counts = np.diff(np.append(first, len(times)))
+            values = np.add.reduceat(values, first) / counts[:, None]
+        elif self.resample == 'max':
+            values = np.maximum.reduceat(values, first)
+        else:
+            values = values[np.append(first[1:], len(times)) - 1]
+        self.times = self.start_date + windows[first] * self.window
+        self.values = values
+        self.row_idx = 0
+
+    def _step_columns(self, time, max_advance):
+        idx = self.row_idx
+        if idx >= len(self.times):
+            raise IndexError('End of CSV file reached.')
+
+        # Check date
+        date = int(self.times[idx])
+        expected_date = self.start_date + time*self.time_resolution
+        if date != expected_date:
+            raise IndexError('Wrong date "%s", expected "%s"' % (
+                self._format_date(date),
+                self._format_date(expected_date)))
+
+        self.cache = self.values[idx].tolist()
+
+        self.row_idx = idx + 1
+        if self.row_idx < len(self.times):
+            delta = int(self.times[self.row_idx]) - date
+            return time + int(delta/self.time_resolution)
+        else:
+            return max_advance
+
+    def _format_date(self, timestamp):
+        return arrow.get(timestamp).format(self.date_format)
 
     def finalize(self):
-        self.datafile.close()
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+        if self.datafile is not None:
+            self.datafile.close()
 
 
 def main():
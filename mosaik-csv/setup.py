@@ -3,7 +3,7 @@ from setuptools import setup
 
 setup(
     name='mosaik-csv',
-    version='1.2.0',
+    version='1.3.0',
     author='Stefan Scherfke',
     author_email='mosaik@offis.de',
     description=('Presents CSV datasets to mosaik as models.'),
@@ -15,7 +15,12 @@ setup(
     install_requires=[
         'arrow>=1.0.0',
         'mosaik-api>=3',
+        'numpy>=1.17',
     ],
+    extras_require={
+        'parquet': ['pyarrow'],
+        'zstd': ['zstandard'],
+    },
     include_package_data=True,
     entry_points={
         'console_scripts': [
@@ -0,0 +1,45 @@
+import arrow
+import pytest
+
+from mosaik_csv import compile_date_format
+
+
+@pytest.mark.parametrize('date_format, date, parser', [
+    ('YYYY-MM-DD HH:mm:ss', '2014-03-05 13:07:09', '_SliceParser'),
+    ('DD.MM.YYYY HH:mm', '05.03.2014 13:07', '_SliceParser'),
+    ('YYYYMMDD[T]HHmm', '20140305T1307', '_SliceParser'),
+    ('YYYY-MM-DD', '2014-03-05', '_SliceParser'),
+    ('D.M.YYYY H:mm', '5.3.2014 3:07', '_StrptimeParser'),
+    ('MMM D, YYYY', 'Mar 5, 2014', '_ArrowParser'),
+    (['YYYY-MM-DD HH:mm', 'YYYY-MM-DD HH:mm:ss'], '2014-03-05 13:07:09',
+     '_FirstMatchParser'),
+    (['YYYY-MM-DD HH:mm', 'YYYY-MM-DD HH:mm:ss'], '2014-03-05 13:07',
+     '_FirstMatchParser'),
+])
+def test_compile_date_format(date_format, date, parser):
+    parse_date = compile_date_format(date_format)
+    assert type(parse_date).__name__ == parser
+    assert parse_date(date) == arrow.get(date, date_format).int_timestamp
+
+
+def test_slice_parser_day_cache():
+    parse_date = compile_date_format('YYYY-MM-DD HH:mm:ss')
+    dates = ['2014-12-31 23:58:00', '2014-12-31 23:59:00',
+             '2015-01-01 00:00:00', '2015-01-01 00:01:00']
+    assert [parse_date(d) for d in dates] == [
+        arrow.get(d).int_timestamp for d in dates]
+
+
+@pytest.mark.parametrize('date', [
+    '2014-01-01 24:00:00',
+    '2014-13-01 00:00:00',
+    '2014-01-01T00:00:00',
+    '2014-01-01 00:00',
+    '2014-01-01 +1:00:00',
+    '2014-01-01 0 :00:00',
+    '+014-01-01 00:00:00',
+    'spam',
+])
+def test_compile_date_format_invalid(date):
+    parse_date = compile_date_format('YYYY-MM-DD HH:mm:ss')
+    pytest.raises(ValueError, parse_date, date)
@@ -1,5 +1,6 @@
 from os.path import dirname, join
 
+import numpy as np
 import pytest
 
 import mosaik_csv
@@ -40,25 +41,27 @@ def test_init_create_errors():
     pytest.raises(ValueError, sim.create, 1, 'bar')
 
 
+@pytest.mark.parametrize('preload', [False, True])
 @pytest.mark.parametrize('start_date', [
     '2013-01-01 00:00:00',
     '2015-01-01 00:00:00',
 ])
-def test_start_date_out_of_range(start_date):
+def test_start_date_out_of_range(start_date, preload):
     sim = mosaik_csv.CSV()
     pytest.raises(ValueError, sim.init, 'sid', 1., sim_start=start_date,
-                  datafile=DATA_FILE)
+                  datafile=DATA_FILE, preload=preload)
 
 
+@pytest.mark.parametrize('preload', [False, True])
 @pytest.mark.parametrize('time_resolution, next_step', [
     (1., 60),
     (2., 30),
     (.5, 120),
 ])
-def test_step_get_data(time_resolution, next_step):
+def test_step_get_data(time_resolution, next_step, preload):
     sim = mosaik_csv.CSV()
     sim.init('sid', time_resolution, sim_start='2014-01-01 00:00:00',
-             datafile=DATA_FILE)
+             datafile=DATA_FILE, preload=preload)
     sim.create(2, 'ModelName')
 
     ret = sim.step(0, {}, 60)
@@ -79,9 +82,11 @@ def test_step_get_data(time_resolution, next_step):
     }
 
 
-def test_step_with_offset():
+@pytest.mark.parametrize('preload', [False, True])
+def test_step_with_offset(preload):
     sim = mosaik_csv.CSV()
-    sim.init('sid', 1., sim_start='2014-01-01 00:03:00', datafile=DATA_FILE)
+    sim.init('sid', 1., sim_start='2014-01-01 00:03:00', datafile=DATA_FILE,
+             preload=preload)
     sim.create(2, 'ModelName')
 
     sim.step(0, {}, 60)
@@ -92,3 +97,408 @@ def test_step_with_offset():
         'ModelName_1': {'P': 3, 'Q': 4},
     }
     pytest.raises(IndexError, sim.step, 60, {}, 120)
+
+
+def test_preload_columns():
+    sim = mosaik_csv.CSV()
+    sim.init('sid', 1., sim_start='2014-01-01 00:01:00', datafile=DATA_FILE,
+             preload=True)
+
+    assert sim.times.dtype == 'int64'
+    assert sim.values.dtype == 'float64'
+    assert sim.values.shape == (4, 2)
+    assert list(sim.times[1:] - sim.times[:-1]) == [60, 60, 60]
+    assert sim.row_idx == 1
+    assert sim.datafile.closed
+
+
+def test_cache(tmp_path):
+    datafile = tmp_path / 'test.csv'
+    datafile.write_bytes(open(DATA_FILE, 'rb').read())
+
+    for i in range(2):
+        sim = mosaik_csv.CSV()
+        meta = sim.init('sid', 1., sim_start='2014-01-01 00:01:00',
+                        datafile=str(datafile), cache=True)
+        assert meta['models']['ModelName']['attrs'] == ['P', 'Q']
+        sim.create(1, 'ModelName')
+        assert sim.step(0, {}, 60) == 60
+        assert sim.get_data({'ModelName_0': ['P']}) == {
+            'ModelName_0': {'P': 1}}
+        sim.finalize()
+    assert isinstance(sim.values, np.memmap)
+    assert sim.datafile is None
+    assert len(list(tmp_path.glob('test.csv.*.json'))) == 1
+
+    # Changing the CSV file invalidates the cache
+    with open(datafile, 'a') as f:
+        f.write('2014-01-01 00:04:00, 4, 5\n')
+    sim = mosaik_csv.CSV()
+    sim.init('sid', 1., sim_start='2014-01-01 00:04:00',
+             datafile=str(datafile), cache=True)
+    assert sim.values.tolist()[sim.row_idx] == [4, 5]
+    assert len(list(tmp_path.glob('test.csv.*.json'))) == 2
+
+
+def test_cache_dir(tmp_path):
+    sim = mosaik_csv.CSV()
+    sim.init('sid', 1., sim_start='2014-01-01 00:00:00', datafile=DATA_FILE,
+             cache=True, cache_dir=str(tmp_path))
+    assert sim.preload
+    assert len(list(tmp_path.glob('test.csv.*.npy'))) == 2
+
+
+@pytest.mark.parametrize('minute', [0, 1, 499, 500, 998, 999])
+def test_seek_start_date(tmp_path, monkeypatch, minute):
+    monkeypatch.setattr(mosaik_csv, '_SEEK_BLOCK', 64)
+    datafile = tmp_path / 'test.csv'
+    with open(datafile, 'w') as f:
+        f.write('ModelName\nDate,P\n')
+        for i in range(1000):
+            f.write('2014-01-01 %02d:%02d:00,%s\n' % (i // 60, i % 60, i))
+
+    sim = mosaik_csv.CSV()
+    sim.init('sid', 60., sim_start='2014-01-01 %02d:%02d:00' % (
+        minute // 60, minute % 60), datafile=str(datafile))
+    sim.create(1, 'ModelName')
+    sim.step(0, {}, 10)
+    assert sim.get_data({'ModelName_0': ['P']}) == {
+        'ModelName_0': {'P': minute}}
+    sim.finalize()
+
+    sim = mosaik_csv.CSV()
+    pytest.raises(ValueError, sim.init, 'sid', 60.,
+                  sim_start='2014-01-01 16:40:00', datafile=str(datafile))
+
+
+def write_parts(tmp_path, header='Date,P'):
+    """Write minutes 0 to 8 of 2014-01-01 into three files."""
+    for part in range(3):
+        with open(tmp_path / ('part_%s.csv' % part), 'w') as f:
+            f.write('ModelName\n%s\n' % header)
+            for i in range(part * 3, part * 3 + 3):
+                f.write('2014-01-01 00:%02d:00,%s\n' % (i, i))
+
+
+@pytest.mark.parametrize('preload, prefetch', [
+    (False, 0),
+    (False, 2),
+    (True, 0),
+])
+@pytest.mark.parametrize('start', [0, 2, 4, 6])
+def test_multiple_files(tmp_path, preload, prefetch, start):
+    write_parts(tmp_path)
+    sim = mosaik_csv.CSV()
+    sim.init('sid', 60., sim_start='2014-01-01 00:%02d:00' % start,
+             datafile=str(tmp_path / 'part_*.csv'), preload=preload,
+             prefetch=prefetch)
+    sim.create(1, 'ModelName')
+
+    values = []
+    time = 0
+    while time < 9 - start:
+        time = sim.step(time, {}, 9 - start)
+        values.append(sim.get_data({'ModelName_0': ['P']})['ModelName_0']['P'])
+    assert values == list(range(start, 9))
+    sim.finalize()
+    assert sim.datafile.closed
+
+
+def test_multiple_files_order(tmp_path):
+    write_parts(tmp_path)
+    sim = mosaik_csv.CSV()
+    sim.init('sid', 60., sim_start='2014-01-01 00:02:00',
+             datafile=[str(tmp_path / ('part_%s.csv' % i)) for i in (2, 0, 1)])
+    sim.create(1, 'ModelName')
+    assert sim.step(0, {}, 10) == 1
+    assert sim.get_data({'ModelName_0': ['P']}) == {'ModelName_0': {'P': 2}}
+    assert sim.step(1, {}, 10) == 2
+    assert sim.get_data({'ModelName_0': ['P']}) == {'ModelName_0': {'P': 3}}
+
+
+def test_multiple_files_errors(tmp_path):
+    write_parts(tmp_path)
+    with open(tmp_path / 'part_3.csv', 'w') as f:
+        f.write('ModelName\nDate,Q\n2014-01-01 00:09:00,9\n')
+
+    sim = mosaik_csv.CSV()
+    pytest.raises(ValueError, sim.init, 'sid', 60.,
+                  sim_start='2014-01-01 00:00:00',
+                  datafile=str(tmp_path / 'part_*.csv'))
+    pytest.raises(FileNotFoundError, sim.init, 'sid', 60.,
+                  sim_start='2014-01-01 00:00:00',
+                  datafile=str(tmp_path / 'spam_*.csv'))
+
+
+@pytest.mark.parametrize('ext', ['', '.gz', '.xz', '.bz2', '.zst'])
+@pytest.mark.parametrize('compression', ['gzip', 'lzma', 'bz2', 'zstd'])
+def test_compressed_file(tmp_path, compression, ext):
+    if compression == 'zstd':
+        compress = pytest.importorskip('zstandard').ZstdCompressor().compress
+    else:
+        compress = __import__(compression).compress
+    datafile = tmp_path / ('test.csv' + ext)
+    datafile.write_bytes(compress(open(DATA_FILE, 'rb').read()))
+    assert mosaik_csv.get_compression(str(datafile)) == compression
+
+    sim = mosaik_csv.CSV()
+    meta = sim.init('sid', 1., sim_start='2014-01-01 00:01:00',
+                    datafile=str(datafile))
+    assert meta['models']['ModelName']['attrs'] == ['P', 'Q']
+    sim.create(1, 'ModelName')
+    assert sim.step(0, {}, 60) == 60
+    assert sim.get_data({'ModelName_0': ['P', 'Q']}) == {
+        'ModelName_0': {'P': 1, 'Q': 2}}
+    sim.finalize()
+    assert sim.datafile.closed
+
+
+@pytest.mark.parametrize('preload', [False, True])
+def test_entity_columns(tmp_path, preload):
+    datafile = tmp_path / 'wide.csv'
+    with open(datafile, 'w') as f:
+        f.write('Houses\n'
+                'Date, P.House_0, Q.House_0, P.House_1, Q.House_1, P.House_2\n'
+                '2014-01-01 00:00:00, 0, 1, 10, 11, 20\n'
+                '2014-01-01 00:01:00, 2, 3, 12, 13, 22\n')
+
+    sim = mosaik_csv.CSV()
+    meta = sim.init('sid', 60., sim_start='2014-01-01 00:00:00',
+                    datafile=str(datafile), preload=preload, entity_sep='.')
+    assert meta['models']['Houses']['attrs'] == ['P', 'Q']
+    assert sim.create(2, 'Houses') == [
+        {'eid': 'House_%s' % i, 'type': 'Houses', 'rel': []}
+        for i in range(2)
+    ]
+    assert sim.create(1, 'Houses')[0]['eid'] == 'House_2'
+    pytest.raises(ValueError, sim.create, 1, 'Houses')
+
+    assert sim.step(0, {}, 2) == 1
+    assert sim.get_data({'House_0': ['P', 'Q'], 'House_1': ['P', 'Q'],
+                         'House_2': ['P']}) == {
+        'House_0': {'P': 0, 'Q': 1},
+        'House_1': {'P': 10, 'Q': 11},
+        'House_2': {'P': 20},
+    }
+    sim.step(1, {}, 2)
+    assert sim.get_data({'House_1': ['Q']}) == {'House_1': {'Q': 13}}
+    pytest.raises(ValueError, sim.get_data, {'House_3': ['P']})
+
+
+def test_get_data_reuses_plan():
+    sim = mosaik_csv.CSV()
+    sim.init('sid', 60., sim_start='2014-01-01 00:00:00', datafile=DATA_FILE)
+    sim.create(3, 'ModelName')
+    outputs = {'ModelName_0': ['P', 'Q'], 'ModelName_1': ['Q'],
+               'ModelName_2': []}
+
+    sim.step(0, {}, 4)
+    data = sim.get_data(outputs)
+    assert data == {'ModelName_0': {'P': 0, 'Q': 1},
+                    'ModelName_1': {'Q': 1}, 'ModelName_2': {}}
+    plan = sim._output_plan
+
+    data['ModelName_0']['P'] = 42
+    sim.step(1, {}, 4)
+    assert sim.get_data(dict(outputs)) == {'ModelName_0': {'P': 1, 'Q': 2},
+                                           'ModelName_1': {'Q': 2},
+                                           'ModelName_2': {}}
+    assert sim._output_plan is plan
+
+    assert sim.get_data({'ModelName_1': ['P']}) == {'ModelName_1': {'P': 1}}
+    assert sim._output_plan is not plan
+
+
+def test_prefetch(tmp_path):
+    datafile = tmp_path / 'test.csv'
+    with open(datafile, 'w') as f:
+        f.write('ModelName\nDate,P\n')
+        for i in range(100):
+            f.write('2014-01-01 %02d:%02d:00,%s\n' % (i // 60, i % 60, i))
+
+    sim = mosaik_csv.CSV()
+    sim.init('sid', 60., sim_start='2014-01-01 00:00:00',
+             datafile=str(datafile), prefetch=4)
+    sim.create(1, 'ModelName')
+    for i in range(60):
+        assert sim.step(i, {}, 100) == i + 1
+        assert sim.get_data({'ModelName_0': ['P']}) == {
+            'ModelName_0': {'P': i}}
+    assert sim.prefetcher.queue.qsize() <= 4
+
+    # Stop the thread although it still has rows to read
+    sim.finalize()
+    assert not sim.prefetcher.is_alive()
+    assert sim.datafile.closed
+
+
+def test_prefetch_error(tmp_path):
+    datafile = tmp_path / 'test.csv'
+    with open(datafile, 'w') as f:
+        f.write('ModelName\nDate,P\n'
+                '2014-01-01 00:00:00,0\n'
+                '2014-01-01 00:01:00,1\n'
+                '2014-01-01 00:02:00,spam\n')
+
+    sim = mosaik_csv.CSV()
+    sim.init('sid', 60., sim_start='2014-01-01 00:00:00',
+             datafile=str(datafile), prefetch=2)
+    sim.create(1, 'ModelName')
+    sim.step(0, {}, 3)
+    pytest.raises(ValueError, sim.step, 1, {}, 3)
+    sim.finalize()
+
+
+@pytest.mark.parametrize('preload, prefetch', [
+    (False, 0),
+    (False, 2),
+    (True, 0),
+])
+@pytest.mark.parametrize('resample, values', [
+    ('mean', [{'P': .5, 'Q': 1.5}, {'P': 2.5, 'Q': 3.5}]),
+    ('last', [{'P': 1, 'Q': 2}, {'P': 3, 'Q': 4}]),
+    ('max', [{'P': 1, 'Q': 2}, {'P': 3, 'Q': 4}]),
+])
+def test_resample(preload, prefetch, resample, values):
+    sim = mosaik_csv.CSV()
+    sim.init('sid', 60., sim_start='2014-01-01 00:00:00', datafile=DATA_FILE,
+             preload=preload, prefetch=prefetch, resample=resample,
+             window=120)
+    sim.create(1, 'ModelName')
+
+    assert sim.step(0, {}, 10) == 2
+    assert sim.get_data({'ModelName_0': ['P', 'Q']}) == {
+        'ModelName_0': values[0]}
+    assert sim.step(2, {}, 10) == 10
+    assert sim.get_data({'ModelName_0': ['P', 'Q']}) == {
+        'ModelName_0': values[1]}
+    pytest.raises(IndexError, sim.step, 4, {}, 10)
+    sim.finalize()
+
+
+@pytest.mark.parametrize('preload', [False, True])
+def test_sim_end(preload):
+    sim = mosaik_csv.CSV()
+    sim.init('sid', 60., sim_start='2014-01-01 00:01:00', datafile=DATA_FILE,
+             preload=preload, sim_end='2014-01-01 00:03:00', resample='mean',
+             window=60)
+    sim.create(1, 'ModelName')
+
+    assert sim.step(0, {}, 10) == 1
+    assert sim.step(1, {}, 10) == 10
+    assert sim.get_data({'ModelName_0': ['P']}) == {'ModelName_0': {'P': 2}}
+    pytest.raises(IndexError, sim.step, 2, {}, 10)
+    sim.finalize()
+
+
+@pytest.mark.parametrize('preload', [False, True])
+def test_sim_end_no_rows(preload):
+    sim = mosaik_csv.CSV()
+    sim.init('sid', 60., sim_start='2014-01-01 00:01:00', datafile=DATA_FILE,
+             preload=preload, sim_end='2014-01-01 00:01:00', resample='last',
+             window=60)
+    sim.create(1, 'ModelName')
+
+    with pytest.raises(IndexError, match='End of CSV file reached.'):
+        sim.step(0, {}, 10)
+    sim.finalize()
+
+
+def test_resample_errors():
+    sim = mosaik_csv.CSV()
+    pytest.raises(ValueError, sim.init, 'sid', 60.,
+                  sim_start='2014-01-01 00:00:00', datafile=DATA_FILE,
+                  resample='median', window=60)
+    pytest.raises(ValueError, sim.init, 'sid', 60.,
+                  sim_start='2014-01-01 00:00:00', datafile=DATA_FILE,
+                  resample='mean')
+
+
+def write_parquet(path, dates, row_group_size=2, **columns):
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+    table = pa.table(dict(Date=dates, **columns))
+    table = table.replace_schema_metadata({'model': 'ModelName'})
+    pq.write_table(table, str(path), row_group_size=row_group_size)
+    return str(path)
+
+
+def parquet_dates(minutes):
+    return np.array(['2014-01-01T00:%02d:00' % m for m in minutes],
+                    dtype='datetime64[s]')
+
+
+@pytest.mark.parametrize('preload', [False, True])
+def test_parquet(tmp_path, preload):
+    datafile = write_parquet(tmp_path / 'data.parquet',
+                             parquet_dates(range(5)),
+                             P=[0., 1., 2., 3., 4.], Q=[1, 2, 3, 4, 5],
+                             name=['a', 'b', 'c', 'd', 'e'])
+    sim = mosaik_csv.CSV()
+    meta = sim.init('sid', 60., sim_start='2014-01-01 00:03:00',
+                    datafile=datafile, preload=preload)
+    assert meta['models'] == {
+        'ModelName': {'public': True, 'params': [], 'attrs': ['P', 'Q']}}
+    sim.create(1, 'ModelName')
+
+    assert sim.step(0, {}, 10) == 1
+    assert sim.get_data({'ModelName_0': ['P', 'Q']}) == {
+        'ModelName_0': {'P': 3, 'Q': 4}}
+    assert sim.step(1, {}, 10) == 10
+    assert sim.get_data({'ModelName_0': ['P']}) == {'ModelName_0': {'P': 4}}
+    pytest.raises(IndexError, sim.step, 2, {}, 10)
+    sim.finalize()
+    assert sim.datafile.closed
+
+
+@pytest.mark.parametrize('preload', [False, True])
+def test_parquet_row_groups(tmp_path, preload):
+    parts = [write_parquet(tmp_path / ('part_%s.pq' % i),
+                           parquet_dates(range(i * 4, i * 4 + 4)),
+                           P=[float(m) for m in range(i * 4, i * 4 + 4)])
+             for i in (1, 0)]
+    sim = mosaik_csv.CSV()
+    sim.init('sid', 60., sim_start='2014-01-01 00:03:00', datafile=parts,
+             preload=preload, sim_end='2014-01-01 00:06:00')
+    sim.create(1, 'ModelName')
+
+    # The row group from 00:00 to 00:01 is skipped
+    assert sim.datafile.skipped
+    for time in range(3):
+        sim.step(time, {}, 10)
+        assert sim.get_data({'ModelName_0': ['P']}) == {
+            'ModelName_0': {'P': time + 3}}
+    pytest.raises(IndexError, sim.step, 3, {}, 10)
+    sim.finalize()
+
+
+@pytest.mark.parametrize('preload', [False, True])
+def test_parquet_start_date(tmp_path, preload):
+    datafile = write_parquet(tmp_path / 'data.parquet',
+                             parquet_dates(range(2, 6)), P=[1., 2., 3., 4.])
+    sim = mosaik_csv.CSV()
+    for start in ['2014-01-01 00:01:00', '2014-01-01 00:06:00']:
+        pytest.raises(ValueError, sim.init, 'sid', 60., sim_start=start,
+                      datafile=datafile, preload=preload)
+
+
+def test_parquet_attrs(tmp_path):
+    datafile = write_parquet(tmp_path / 'data.parquet', parquet_dates([0]),
+                             **{'P.a': [1.], 'P.b': [2.], 'Q.a': [3.],
+                                'Q.b': [4.]})
+    sim = mosaik_csv.CSV()
+    meta = sim.init('sid', 60., sim_start='2014-01-01 00:00:00',
+                    datafile=datafile, entity_sep='.', attrs=['P'])
+    assert meta['models']['ModelName']['attrs'] == ['P']
+    sim.create(2, 'ModelName')
+    sim.step(0, {}, 10)
+    assert sim.get_data({'a': ['P'], 'b': ['P']}) == {
+        'a': {'P': 1}, 'b': {'P': 2}}
+    sim.finalize()
+
+    pytest.raises(ValueError, sim.init, 'sid', 60.,
+                  sim_start='2014-01-01 00:00:00', datafile=datafile,
+                  attrs=['X'])
+    pytest.raises(ValueError, sim.init, 'sid', 60.,
+                  sim_start='2014-01-01 00:00:00', datafile=DATA_FILE,
+                  attrs=['P'])
@@ -0,0 +1,76 @@
+"""
+Measure how long it takes to decompress and to parse a profile file for each
+supported compression format.
+
+Usage::
+
+    $ python benchmarks/bench_decompress.py [num_profiles] [num_days]
+
+"""
+import bz2
+import gzip
+import lzma
+import os
+import sys
+import tempfile
+import time
+
+from householdsim.model import ProfileData, open_profile_file
+
+from profiles import write_profiles
+
+
+def compressors():
+    yield 'none', lambda data: data
+    yield 'gzip', gzip.compress
+    yield 'xz', lzma.compress
+    yield 'bz2', bz2.compress
+    try:
+        import zstandard
+    except ImportError:
+        pass
+    else:
+        yield 'zstd', zstandard.ZstdCompressor().compress
+
+
+def bench(path):
+    """Return the time to read and the time to parse the file *path*."""
+    start = time.perf_counter()
+    with open_profile_file(path) as f:
+        while f.read(1 << 20):
+            pass
+    read = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open_profile_file(path) as f:
+        ProfileData.parse(f)
+    parse = time.perf_counter() - start
+    return read, parse
+
+
+def main():
+    num_profiles = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    num_days = int(sys.argv[2]) if len(sys.argv) > 2 else 112
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'profiles.data')
+        with open(path, 'w') as f:
+            write_profiles(f, num_profiles, num_days)
+        with open(path, 'rb') as f:
+            data = f.read()
+        size = len(data) / 1e6
+
+        print('%d profiles, %d days, %.1f MB' % (num_profiles, num_days, size))
+        print('%6s %10s %12s %12s %12s' % ('codec', 'size [MB]', 'read [s]',
+                                          'read [MB/s]', 'parse [s]'))
+        for name, compress in compressors():
+            cpath = '%s.%s' % (path, name)
+            with open(cpath, 'wb') as f:
+                f.write(compress(data))
+            read, parse = bench(cpath)
+            print('%6s %10.1f %12.3f %12.1f %12.3f' % (
+                name, os.path.getsize(cpath) / 1e6, read, size / read, parse))
+
+
+if __name__ == '__main__':
+    main()
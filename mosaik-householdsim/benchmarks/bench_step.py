@@ -0,0 +1,58 @@
+"""
+Measure the cost of HouseholdSim.step() and HouseholdSim.get_data() for
+growing numbers of houses.
+
+Usage::
+
+    $ python benchmarks/bench_step.py
+
+"""
+import os
+import tempfile
+import timeit
+
+from householdsim import mosaik
+
+from profiles import write_profiles
+
+
+HOUSES = [100, 1000, 10000]
+PROFILES = 100
+DAYS = 7
+
+
+def bench(tmpdir, num_houses, get_data):
+    path = os.path.join(tmpdir, 'profiles_%s.data' % num_houses)
+    with open(path, 'w') as f:
+        write_profiles(f, PROFILES, DAYS, num_houses)
+    sim = mosaik.HouseholdSim()
+    sim.init('sid', 60.)
+    entities = sim.create(1, 'ResidentialLoads',
+                          sim_start='2014-01-01 00:00:00',
+                          profile_file=path, grid_name='grid')
+    outputs = {c['eid']: ['P_out'] for c in entities[0]['children']}
+
+    time = 0
+    def step():
+        nonlocal time
+        time = sim.step(time, {}, DAYS * 1440)
+        if get_data:
+            sim.get_data(outputs)
+
+    number = DAYS * 96 - 1
+    return timeit.timeit(step, number=number) / number
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print('%10s %15s %20s' % ('houses', 'step [ms]',
+                                  'step+get_data [ms]'))
+        for num_houses in HOUSES:
+            print('%10d %15.3f %20.3f' % (
+                num_houses,
+                bench(tmpdir, num_houses, False) * 1000,
+                bench(tmpdir, num_houses, True) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""
+Synthetic profile files for the benchmarks.
+
+"""
+import datetime
+import random
+
+
+def write_profiles(f, num_profiles, num_days, num_houses=None):
+    """Write a profile file with *num_profiles* random profiles of
+    *num_days* days in 15 minute resolution to the text file *f*.
+
+    The ID list "grid" contains *num_houses* nodes (default:
+    *num_profiles*).
+
+    """
+    if num_houses is None:
+        num_houses = num_profiles
+    f.write('# meta\n')
+    f.write('{"unit": "W", "resolution": 15, "start_date": "2014-01-01 00:00", '
+            '"num_profiles": %d}\n' % num_profiles)
+    f.write('# id_lists\n')
+    f.write('{"grid": [%s]}\n' % ', '.join('"n%d"' % i
+                                          for i in range(num_houses)))
+    f.write('# attrs\n')
+    f.write('num_hh,%s\n' % ','.join('1' for _ in range(num_profiles)))
+    f.write('num_residents,%s\n' % ','.join('2' for _ in range(num_profiles)))
+    f.write('# profiles\n')
+    rnd = random.Random(0)
+    start = datetime.datetime(2014, 1, 1)
+    for i in range(num_days * 96):
+        date = start + datetime.timedelta(minutes=15 * i)
+        f.write('%s,%s\n' % (date.strftime('%Y-%m-%d %H:%M'), ','.join(
+            '%.1f' % rnd.uniform(0, 5000) for _ in range(num_profiles))))
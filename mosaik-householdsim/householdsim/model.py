@@ -1,24 +1,346 @@
 """
 
 """
+import collections.abc
+import hashlib
 import json
+import logging
+import os
 
 import arrow
+import numpy as np
+from mosaik_csv import compile_date_format, open_datafile
 
 
+logger = logging.getLogger('householdsim')
+
 DATE_FORMAT = ['YYYY-MM-DD HH:mm', 'YYYY-MM-DD HH:mm:ss']
 """Date format used to convert strings to dates."""
 
+parse_date = compile_date_format(DATE_FORMAT)
+"""Convert a string formatted like :data:`DATE_FORMAT` to epoch seconds."""
 
-class HouseModel:
-    """The HouseModel processes and prepares the load profiles and their
-    associated meta data to allow and easier access to it.
+_json_decoder = json.JSONDecoder()
+
+
+def open_profile_file(path):
+    """Open the profile file *path* for reading text.
+
+    Files compressed with gzip, lzma/xz, bzip2 or zstd are detected by their
+    magic bytes and decompressed while they are read (see
+    :func:`mosaik_csv.open_datafile()`).
+
+    """
+    return open_datafile(path)
+
+
+def parse_id_lists(data, grids=None, other=None):
+    """Parse the ``# id_lists`` section of a profile file from the iterator
+    *data* (up to and including the ``# attrs`` line).
+
+    Return a dict with the ID lists of the grids in *grids* (or of all grids
+    if it is ``None``).  The section is decoded incrementally, one ID list at
+    a time, so the ID lists of other grids are never kept in memory.  If
+    *other* is a dict, the undecoded JSON text of their ID lists is stored in
+    it instead, so that they can be decoded later without reading the file
+    again.
+
+    """
+    id_lists = {}
+    state = '{'
+    buf = ''
+    for line in data:
+        if line.startswith('# attrs'):
+            break
+        # Lists that span several lines can only be complete at a "]"
+        if buf and state == 'value' and ']' not in line and '}' not in line:
+            buf += line
+            continue
+        buf += line
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos == len(buf):
+                break
+            char = buf[pos]
+            if state in ('{', ':'):
+                if char != state:
+                    raise ValueError('Invalid ID lists: Expected "%s".' %
+                                     state)
+                state = 'key' if state == '{' else 'value'
+                pos += 1
+            elif state == ',' and char in ',}':
+                state = 'key' if char == ',' else 'end'
+                pos += 1
+            elif state == 'key' and char == '}':
+                state = 'end'
+                pos += 1
+            elif state in ('key', 'value'):
+                try:
+                    obj, end = _json_decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    break  # Incomplete, read the next line
+                if state == 'key':
+                    grid = obj
+                    state = ':'
+                else:
+                    if grids is None or grid in grids:
+                        id_lists[grid] = obj
+                    elif other is not None:
+                        other[grid] = buf[pos:end]
+                    state = ','
+                pos = end
+            else:
+                raise ValueError('Invalid ID lists: Unexpected "%s".' % char)
+        buf = buf[pos:]
+
+    if state != 'end':
+        raise ValueError('Invalid ID lists: Unexpected end.')
+    return id_lists
+
+
+def read_id_lists(path, grids=None):
+    """Read the ID lists of *grids* from the profile file *path* without
+    reading its profiles (see :func:`parse_id_lists()`)."""
+    with open_profile_file(path) as data:
+        assert next(data).startswith('# meta')
+        next(data)
+        assert next(data).startswith('# id_list')
+        return parse_id_lists(data, grids)
+
+
+class _IdListIndex(collections.abc.Mapping):
+    """Map grid names to ID lists that are read from the file *path* on
+    demand.  *index* maps grid names to the offset and size of their JSON
+    encoded ID list."""
+    def __init__(self, path, index):
+        self.path = path
+        self.index = index
+
+    def __getitem__(self, grid):
+        offset, size = self.index[grid]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(size).decode())
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class _LazyIdLists(collections.abc.Mapping):
+    """Map grid names to ID lists.  *id_lists* is a dict with the decoded
+    ID lists and *texts* a dict with the JSON text of the other ID lists,
+    which are decoded when they are first accessed."""
+    def __init__(self, id_lists, texts):
+        self.id_lists = id_lists
+        self.texts = texts
+
+    def __getitem__(self, grid):
+        if grid not in self.id_lists:
+            self.id_lists[grid] = json.loads(self.texts.pop(grid))
+        return self.id_lists[grid]
+
+    def __iter__(self):
+        yield from self.id_lists
+        yield from self.texts
+
+    def __len__(self):
+        return len(self.id_lists) + len(self.texts)
+
+
+class ProfileData:
+    """The load profiles of a profile file and their meta data.
+
+    Use :meth:`parse()` to read them from a profile file or :meth:`load()` to
+    read them from a binary cache of the file.
 
     """
-    def __init__(self, data, lv_grid):
+    def __init__(self, meta, id_lists, attrs, profiles):
+        self.meta = meta
+        """The meta data of the profiles (start date, resolution, unit and
+        number of profiles)."""
+        self.id_lists = id_lists
+        """Mapping of grid names to lists of node IDs.  The ID lists of grids
+        that were not requested may only be decoded on first access."""
+        self.attrs = attrs
+        """Dict mapping static attribute names to one value per profile."""
+        self.profiles = profiles
+        """Array with one row per date and one column per load profile."""
+        self._coefficients = {}
+
+    @classmethod
+    def parse(cls, data, grids=None):
+        """Parse the lines of a profile file from the iterator *data*.
+
+        Only the ID lists of *grids* are decoded (all by default).  The JSON
+        text of the others is kept and decoded on demand.
+
+        """
         # Process meta data
         assert next(data).startswith('# meta')
         meta = json.loads(next(data))
+
+        # Obtain id lists
+        assert next(data).startswith('# id_list')
+        if grids is None:
+            id_lists = parse_id_lists(data)
+        else:
+            texts = {}
+            id_lists = _LazyIdLists(parse_id_lists(data, grids, texts), texts)
+
+        # Enable pre-processing of the data
+        data = cls._get_line(data)
+
+        # Obtain static attributes
+        attrs = {}
+        for attr, *vals in data:
+            if attr.startswith('# profiles'):
+                break
+            attrs[attr] = [int(val) for val in vals]
+
+        # Index the profiles, so that they can be looked up by date
+        profiles = []
+        start = parse_date(meta['start_date'])
+        step = meta['resolution'] * 60
+        for i, (date, *values) in enumerate(data):
+            expected_date = start + i * step
+            if parse_date(date) != expected_date:
+                raise ValueError('Profile date "%s" does not match the '
+                                 'resolution, expected "%s".' % (
+                                     date, arrow.get(expected_date).format(
+                                         DATE_FORMAT[0])))
+            profiles.append(values)
+        profiles = np.array(profiles, dtype=np.float64).reshape(
+            len(profiles), meta['num_profiles'])
+
+        return cls(meta, id_lists, attrs, profiles)
+
+    @classmethod
+    def load(cls, path, cache_dir=None):
+        """Load the profile file *path* from a binary cache in *cache_dir*
+        (the directory of *path* by default).
+
+        The cache is created if it doesn't exist yet.  It consists of a JSON
+        file with the meta data and attributes, a file with one ID list per
+        line and a ``.npy`` file with the profiles, which is memory-mapped.
+        Processes that load the same cache thus share its pages.  The JSON
+        file also contains the position of each grid's ID list, so that only
+        the ID lists of the requested grids are read.  The name of the cache
+        files contains a hash of the path, modification time and size of the
+        profile file, so the cache is rebuilt whenever it changes.
+
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = repr((path, stat.st_mtime_ns, stat.st_size))
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        base = os.path.join(cache_dir or os.path.dirname(path), '%s.%s' % (
+            os.path.basename(path), digest))
+
+        try:
+            with open(base + '.json') as f:
+                header = json.load(f)
+            profiles = np.load(base + '.profiles.npy', mmap_mode='r')
+        except (OSError, ValueError):
+            pass
+        else:
+            id_lists = _IdListIndex(base + '.id_lists', header['id_lists'])
+            return cls(header['meta'], id_lists, header['attrs'], profiles)
+
+        with open_profile_file(path) as f:
+            data = cls.parse(f)
+        try:
+            # Write to temporary files and rename them, so that concurrent
+            # processes never see incomplete files.  The JSON header is
+            # written last and marks the cache as complete.
+            tmp = '%s.profiles.npy.%s.tmp' % (base, os.getpid())
+            with open(tmp, 'wb') as f:
+                np.save(f, data.profiles)
+            os.replace(tmp, base + '.profiles.npy')
+            index = {}
+            tmp = '%s.id_lists.%s.tmp' % (base, os.getpid())
+            with open(tmp, 'wb') as f:
+                for grid, node_ids in data.id_lists.items():
+                    line = json.dumps(node_ids).encode()
+                    index[grid] = (f.tell(), len(line))
+                    f.write(line + b'\n')
+            os.replace(tmp, base + '.id_lists')
+            tmp = '%s.json.%s.tmp' % (base, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump({'meta': data.meta, 'id_lists': index,
+                           'attrs': data.attrs}, f)
+            os.replace(tmp, base + '.json')
+        except OSError as e:
+            logger.warning('Could not write cache for "%s": %s' % (path, e))
+        return data
+
+    def coefficients(self, interpolation):
+        """Return the coefficients of the polynomials that interpolate the
+        profiles between two dates.
+
+        *interpolation* is ``'linear'`` or ``'spline'`` (a cubic Hermite
+        spline whose tangents are the central differences of the profiles).
+        The result has the shape ``(degree + 1, dates, profiles)``.  The
+        value at the fraction *u* of the interval after the date *i* is the
+        sum of ``c[k, i] * u**k``.  The last date keeps its value.
+
+        The coefficients are only computed once for each interpolation.
+
+        """
+        if interpolation in self._coefficients:
+            return self._coefficients[interpolation]
+
+        p = np.asarray(self.profiles)
+        delta = np.zeros_like(p)
+        delta[:-1] = p[1:] - p[:-1]
+        if interpolation == 'linear':
+            coefficients = np.stack([p, delta])
+        elif interpolation == 'spline':
+            tangents = np.zeros_like(p)
+            if len(p) > 1:
+                tangents[0] = p[1] - p[0]
+                tangents[-1] = p[-1] - p[-2]
+                tangents[1:-1] = (p[2:] - p[:-2]) / 2
+            next_tangents = np.zeros_like(p)
+            next_tangents[:-1] = tangents[1:]
+            tangents[-1] = 0
+            coefficients = np.stack([
+                p,
+                tangents,
+                3 * delta - 2 * tangents - next_tangents,
+                -2 * delta + tangents + next_tangents,
+            ])
+        else:
+            raise ValueError('Invalid interpolation "%s".' % interpolation)
+
+        self._coefficients[interpolation] = coefficients
+        return coefficients
+
+    @staticmethod
+    def _get_line(iterator):
+        for line in iterator:
+            yield [item.strip() for item in line.split(',')]
+
+
+class HouseModel:
+    """The HouseModel processes and prepares the load profiles and their
+    associated meta data to allow and easier access to it.
+
+    *data* is either an iterator over the lines of a profile file or a
+    :class:`ProfileData` instance.  If *interpolation* is ``'linear'`` or
+    ``'spline'``, the loads are interpolated between the dates of the
+    profiles (see :meth:`ProfileData.coefficients()`).
+
+    """
+    def __init__(self, data, lv_grid, interpolation=None):
+        if not isinstance(data, ProfileData):
+            data = ProfileData.parse(data)
+
+        meta = data.meta
         self.start = arrow.get(meta['start_date'], DATE_FORMAT)
         """The start date of the profile data."""
         self.resolution = meta['resolution']
@@ -28,26 +350,10 @@ class HouseModel:
         self.num_profiles = meta['num_profiles']
         """The number of load profiles in the file."""
 
-        # Obtain id lists
-        assert next(data).startswith('# id_list')
-        id_list_lines = []
-        for line in data:
-            if line.startswith('# attrs'):
-                break
-            id_list_lines.append(line)
-        id_lists = json.loads(''.join(id_list_lines))
-        self.node_ids = id_lists[lv_grid]
+        self.node_ids = data.id_lists[lv_grid]
         """List of power grid node IDs for which to create houses."""
 
-        # Enable pre-processing of the data
-        self._data = self._get_line(data)
-
-        # Obtain static attributes and create list of house info dicts
-        attrs = {}
-        for attr, *vals in self._data:
-            if attr.startswith('# profiles'):
-                break
-            attrs[attr] = [int(val) for val in vals]
+        attrs = data.attrs
 
         #: List of house info dicts
         self.houses = [
@@ -59,43 +365,85 @@ class HouseModel:
             } for i, n in enumerate(self.node_ids)
         ]
 
+        #: Array with one row per date and one column per load profile
+        self.profiles = data.profiles
+
+        #: Index of the profile of each house
+        self.profile_idx = np.arange(len(self.houses)) % self.num_profiles
+
+        self.interpolation = interpolation
+        """How to interpolate between dates (``None``, ``'linear'`` or
+        ``'spline'``)."""
+        self._coefficients = None
+        if interpolation is not None:
+            self._coefficients = data.coefficients(interpolation)
+
         # Helpers for get()
-        self._last_date = None
+        self._last_key = None
         self._cache = None
 
     def get(self, minutes):
         """Get the current load for all houses for *minutes* minutes since
-        :attr:`start`.
+        :attr:`start` as an array.
 
         If the model uses a 15min resolution and minutes not multiple of 15,
         the next smaller multiple of 15 will be used. For example, if you
-        pass ``minutes=23``, you'll get the value for ``15``.
+        pass ``minutes=23``, you'll get the value for ``15``.  If
+        :attr:`interpolation` is set, the value at ``23`` is interpolated
+        instead (and *minutes* may be a float).
+
+        Since all profiles are indexed when the model is created, any
+        *minutes* can be requested in any order.  Raise an
+        :exc:`IndexError` if there is no data for them.
 
         """
-        # Trim "minutes" to multiples of "self.resolution"
-        # Example: res=15, minutes=40 -> minutes == 30
-        minutes = minutes // self.resolution * self.resolution
-
-        target_date = self.start.shift(minutes=minutes)
-        if target_date != self._last_date:
-            # If target date not already reached, search data until we find it:
-            for date, *values in self._data:
-                date = arrow.get(date, DATE_FORMAT)
-                if date == target_date:
-                    # Found target date, cache results:
-                    values = list(map(float, values))
-                    self._cache = [values[i % self.num_profiles]
-                                   for i, _ in enumerate(self.houses)]
-                    self._last_date = date
-                    break
-            else:
-                # We've reached the end of our data file if the for loop
-                # normally finishes.
-                raise IndexError('Target date "%s" (%s minutes from start) '
-                                 'out of range.' % (target_date, minutes))
+        key = minutes if self.interpolation else self.index(minutes)
+        if key != self._last_key:
+            self._cache = self.get_profiles(minutes, self.profile_idx)
+            self._last_key = key
 
         return self._cache
 
+    def get_profiles(self, minutes, profile_idx, shift=None):
+        """Get the values of the profiles *profile_idx* (an index array) for
+        *minutes* minutes since :attr:`start`.
+
+        *shift* optionally shifts each profile by a number of minutes.  The
+        shifted times are clipped to the dates of the profiles.
+
+        """
+        row = self.index(minutes)
+        if shift is not None:
+            minutes = np.clip(minutes + shift, 0,
+                              (len(self.profiles) - 1) * self.resolution)
+            row = (minutes // self.resolution).astype(int)
+        if self._coefficients is None:
+            return self.profiles[row, profile_idx]
+
+        # Evaluate the polynomials with Horner's method
+        u = (minutes - row * self.resolution) / self.resolution
+        coefficients = self._coefficients[:, row, profile_idx]
+        values = coefficients[-1]
+        for c in coefficients[-2::-1]:
+            values = values * u + c
+        return values
+
+    def index(self, minutes):
+        """Return the index of the row of :attr:`profiles` for *minutes*
+        minutes since :attr:`start`.
+
+        Raise an :exc:`IndexError` if there is no data for them.
+
+        """
+        idx = int(minutes // self.resolution)
+        if not 0 <= idx < len(self.profiles):
+            minutes = idx * self.resolution
+            target_date = self.start.int_timestamp + minutes * 60
+            raise IndexError('Target date "%s" (%s minutes from start) '
+                             'out of range.' % (arrow.get(target_date),
+                                                minutes))
+        return idx
+
     def get_delta(self, date):
         """Get the amount of minutes between *date* and :attr:`start`.
 
@@ -104,14 +452,10 @@ class HouseModel:
         Raise a :exc:`ValueError` if *date* is smaller than :attr:`start`.
 
         """
-        date = arrow.get(date, DATE_FORMAT)
-        if date < self.start:
+        date = parse_date(date)
+        if date < self.start.int_timestamp:
             raise ValueError('date must >= "%s".' %
-                             self.start.format(DATE_FORMAT))
-        dt = date - self.start
-        minutes = (dt.days * 1440) + (dt.seconds // 60)
+                             self.start.format(DATE_FORMAT[0]))
+        minutes = (date - self.start.int_timestamp) // 60
         return minutes
 
-    def _get_line(self, iterator):
-        for line in iterator:
-            yield [item.strip() for item in line.split(',')]
@@ -1,6 +1,8 @@
 import logging
+import os
 
 import mosaik_api
+import numpy as np
 
 import householdsim.model
 
@@ -35,6 +37,16 @@ meta = {
 }
 
 
+VARIATION = {
+    'seed': 0,  # Seed for the random numbers
+    'shift': 0,  # Max. time shift of a house's profile [minutes]
+    'scale': 0.,  # Std. deviation of a house's scaling factor (mean: 1)
+    'noise': 0.,  # Std. deviation of the noise factor per step (mean: 1)
+}
+"""Default parameters of the profile variation (see
+:meth:`HouseholdSim.init()`)."""
+
+
 def eid(hid):
     return 'House_%s' % hid
 
@@ -44,80 +56,213 @@ class HouseholdSim(mosaik_api.Simulator):
         super().__init__(meta)
 
         self.time_resolution = None
-        self.model = None
+        self.models = []
         self.houses_by_eid = {}
+        self.house_idx = {}
         self.pos_loads = None
+        self.cache_profiles = False
+        self.cache_dir = None
+        self.interpolation = None
+        self.step_size = None
+        self.variation = None
         self._file_cache = {}
-        self._offset = 0
-        self._cache = {}
+        # Maps (profile file, offset) to a model for looking up rows, the
+        # indices of the houses, the indices of their profiles and their
+        # time shifts
+        self._batches = {}
+        self._resolution = None
+        self._values = np.empty(0)
+        self._loads = np.empty(0)
+        self._shift = np.empty(0, dtype=int)
+        self._scale = np.empty(0)
+        self._cache = None
+        self._outputs = None
+        self._output_plan = None
+
+    def init(self, sid, time_resolution, pos_loads=True, cache_profiles=False,
+             cache_dir=None, interpolation=None, step_size=None,
+             variation=None):
+        if interpolation not in (None, 'linear', 'spline'):
+            raise ValueError('Invalid interpolation "%s".' % interpolation)
+        if variation is not None:
+            invalid = set(variation) - set(VARIATION)
+            if invalid:
+                raise ValueError('Invalid variation parameters: %s' %
+                                 ', '.join(sorted(invalid)))
+            variation = dict(VARIATION, **variation)
 
-    def init(self, sid, time_resolution, pos_loads=True):
         self.time_resolution = float(time_resolution)
         logger.debug('Loads will be %s numbers.' %
                      ('positive' if pos_loads else 'negative'))
         self.pos_loads = 1 if pos_loads else -1
+        self.cache_profiles = cache_profiles
+        self.cache_dir = cache_dir
+        self.interpolation = interpolation
+        # Interpolated loads are stepped every minute by default
+        self.step_size = step_size or max(1, int(60 / self.time_resolution))
+        self.variation = variation
         return self.meta
 
     def create(self, num, model, sim_start, profile_file, grid_name):
-        if num != 1 or self.model:
-            raise ValueError('Can only create one set of houses.')
+        logger.info('Creating %d set(s) of houses for %s from "%s"' %
+                    (num, grid_name, profile_file))
 
-        logger.info('Creating houses for %s from "%s"' %
-                    (grid_name, profile_file))
+        # Profile files are only parsed once, even if several grids use them
+        path = os.path.abspath(profile_file)
+        if path not in self._file_cache:
+            if self.cache_profiles:
+                data = householdsim.model.ProfileData.load(path,
+                                                           self.cache_dir)
+            else:
+                # The model reads all profiles, so the file can be closed
+                with householdsim.model.open_profile_file(path) as pf:
+                    data = householdsim.model.ProfileData.parse(
+                        pf, [grid_name])
+            self._file_cache[path] = data
+        data = self._file_cache[path]
 
-        if profile_file.endswith('gz'):
-            import gzip
-            pf = gzip.open(profile_file, 'rt')
-        else:
-            pf = open(profile_file, 'rt')
-
-        try:
-            self.model = householdsim.model.HouseModel(pf, grid_name)
-            self.houses_by_eid = {
-                eid(i): house for i, house in enumerate(self.model.houses)
-            }
-        except KeyError:
-            raise ValueError('Invalid grid name "%s".' % grid_name)
-
-        # A time offset in minutes from the simulation start to the start
-        # of the profiles.
-        self._offset = self.model.get_delta(sim_start)
-
-        return [{
-            'eid': 'resid_0',
-            'type': 'ResidentialLoads',
-            'rel': [],
-            'children': [{'eid': eid(i), 'type': 'House', 'rel': []}
-                         for i, _ in enumerate(self.model.houses)],
-        }]
+        entities = []
+        for _ in range(num):
+            try:
+                house_model = householdsim.model.HouseModel(
+                    data, grid_name, self.interpolation)
+            except KeyError:
+                raise ValueError('Invalid grid name "%s".' % grid_name)
+
+            # A time offset in minutes from the simulation start to the start
+            # of the profiles.
+            offset = house_model.get_delta(sim_start)
+
+            first = len(self.houses_by_eid)
+            children = []
+            for hid, house in enumerate(house_model.houses, first):
+                self.houses_by_eid[eid(hid)] = house
+                self.house_idx[eid(hid)] = hid
+                children.append({'eid': eid(hid), 'type': 'House', 'rel': []})
+
+            if self.variation is not None:
+                shift, scale = self._vary(len(self.models), len(children))
+                self._shift = np.append(self._shift, shift)
+                self._scale = np.append(self._scale, scale)
+
+            # The houses of all sets with the same profiles and offset are
+            # stepped together.
+            batch_model, houses, profile_idx, _ = self._batches.get(
+                (path, offset), (house_model, [], [], None))
+            houses = np.append(houses, np.arange(first, first + len(children))
+                               ).astype(int)
+            self._batches[path, offset] = (
+                batch_model,
+                houses,
+                np.append(profile_idx, house_model.profile_idx).astype(int),
+                None if self.variation is None else self._shift[houses])
+
+            entities.append({
+                'eid': 'resid_%s' % len(self.models),
+                'type': 'ResidentialLoads',
+                'rel': [],
+                'children': children,
+            })
+            self.models.append(house_model)
+
+        # Arrays for step() and get_data(), so that they only need to be
+        # allocated once
+        self._values = np.zeros(len(self.houses_by_eid))
+        self._loads = np.zeros(len(self.houses_by_eid))
+        self._resolution = min(house_model.resolution
+                               for house_model in self.models)
+        self._outputs = None
+        return entities
 
     def step(self, time, inputs, max_advance):
         # "time" has self.time_resolution (seconds per integer step).
         # Convert to minutes and add the offset if sim start > start date of
         # the profiles.
-        minutes = int(time*self.time_resolution // 60)
-        minutes_offset = minutes + self._offset
-        cache = {}
-        data = self.model.get(minutes_offset)
-        for hid, d in enumerate(data):
-            d *= self.pos_loads  # Flip sign if necessary
-            cache[eid(hid)] = d
-        self._cache = cache
-        return int((minutes + self.model.resolution) * 60
-                   / self.time_resolution)
+        if self.interpolation:
+            minutes = time * self.time_resolution / 60
+        else:
+            minutes = int(time * self.time_resolution // 60)
+        values = self._values
+        for (_, offset), (house_model, houses, profile_idx, shift) in \
+                self._batches.items():
+            values[houses] = house_model.get_profiles(minutes + offset,
+                                                      profile_idx, shift)
+        if self.variation is not None:
+            values *= self._scale
+            values *= self._noise(time)
+        # Flip sign if necessary
+        np.multiply(values, self.pos_loads, out=self._loads)
+        self._cache = None
+        if self.interpolation:
+            return time + self.step_size
+        return int((minutes + self._resolution) * 60 / self.time_resolution)
+
+    def _rng(self, stream, counter):
+        """Return a random number generator for the *counter*-th number of
+        the stream *stream*.
+
+        The generators are counter-based and keyed by the seed, so the
+        numbers only depend on the seed, *stream* and *counter*, but not on
+        the order in which they are requested.
+
+        """
+        bit_generator = np.random.Philox(key=self.variation['seed'],
+                                         counter=[0, counter, stream, 0])
+        return np.random.Generator(bit_generator)
+
+    def _vary(self, set_idx, num):
+        """Return the time shifts and scaling factors of the *num* houses
+        of the house set *set_idx*."""
+        rng = self._rng(1, set_idx)
+        max_shift = self.variation['shift']
+        shift = rng.integers(-max_shift, max_shift, size=num, endpoint=True)
+        scale = rng.normal(1, self.variation['scale'], size=num)
+        return shift, np.maximum(scale, 0)
+
+    def _noise(self, time):
+        """Return the noise factors of all houses for the step *time*."""
+        noise = self.variation['noise']
+        if not noise:
+            return 1
+        factors = self._rng(0, time).normal(1, noise, size=len(self._values))
+        return np.maximum(factors, 0)
 
     def get_data(self, outputs):
+        # The houses and attributes requested rarely change between steps.
+        # Look up the houses' load indices and static attributes only once.
+        if outputs != self._outputs:
+            self._output_plan = self._compile_outputs(outputs)
+            self._outputs = {eid: list(attrs)
+                             for eid, attrs in outputs.items()}
+        if self._cache is None:
+            self._cache = self._loads.tolist()
+
+        loads = self._cache
         data = {}
-        for eid, attrs in outputs.items():
-            data[eid] = {}
-            for attr in attrs:
-                if attr == 'P_out':
-                    val = self._cache[eid]
-                else:
-                    val = self.houses_by_eid[eid][attr]
-                data[eid][attr] = val
+        for eid, idx, static in self._output_plan:
+            values = static.copy()
+            if idx is not None:
+                values['P_out'] = loads[idx]
+            data[eid] = values
         return data
 
+    def _compile_outputs(self, outputs):
+        """Return a list of ``(eid, idx, static)`` tuples for *outputs*.
+
+        *idx* is the index of the house's load (or ``None`` if ``P_out`` is
+        not requested) and *static* a dict with the other requested
+        attributes.
+
+        """
+        plan = []
+        for eid, attrs in outputs.items():
+            house = self.houses_by_eid[eid]
+            static = {attr: None if attr == 'P_out' else house[attr]
+                      for attr in attrs}
+            idx = self.house_idx[eid] if 'P_out' in static else None
+            plan.append((eid, idx, static))
+        return plan
+
 
 def main():
     return mosaik_api.start_simulation(HouseholdSim(), 'Household simulation')
@@ -14,7 +14,12 @@ setup(
     install_requires=[
         'arrow>=1.1.0',
         'mosaik-api>=3.0',
+        'mosaik-csv>=1.3',
+        'numpy>=1.17',
     ],
+    extras_require={
+        'zstd': ['zstandard'],
+    },
     packages=find_packages(),
     include_package_data=True,
     entry_points={
@@ -1,9 +1,12 @@
+import json
 from os.path import dirname, join
 
 import arrow
+import numpy as np
 import pytest
 
-from householdsim.model import HouseModel
+from householdsim.model import (HouseModel, ProfileData, open_profile_file,
+                                parse_id_lists, read_id_lists)
 
 
 data_file = join(dirname(__file__), 'data', 'test.data')
@@ -43,6 +46,8 @@ def test_housemodel_init(lv_grid, res_houses, res_profiles):
     assert hm.houses == res_houses
     assert hm.unit == 'W'
     assert hm.num_profiles == 3
+    assert hm.profiles.shape == (10, 3)
+    assert hm.get(15).tolist() == [p[1] for p in res_profiles]
 
 
 def test_housemodel_get(hm):
@@ -52,7 +57,7 @@ def test_housemodel_get(hm):
         minutes = i * 15
         ret = hm.get(minutes)
         print(minutes, ret)
-        assert ret == [minutes // 15, minutes // 15 + 1]
+        assert ret.tolist() == [minutes // 15, minutes // 15 + 1]
 
     pytest.raises(IndexError, hm.get, (i + 1) * 15)
 
@@ -63,7 +68,7 @@ def test_housemodel_get_fast(hm):
     for i in range(30):
         minutes = i * 5
         ret = hm.get(minutes)
-        assert ret == [minutes // 15, minutes // 15 + 1]
+        assert ret.tolist() == [minutes // 15, minutes // 15 + 1]
 
     pytest.raises(IndexError, hm.get, (i + 1) * 5)
 
@@ -74,7 +79,7 @@ def test_housemodel_get_slow(hm):
     for i in range(5):
         minutes = i * 30
         ret = hm.get(minutes)
-        assert ret == [minutes // 15, minutes // 15 + 1]
+        assert ret.tolist() == [minutes // 15, minutes // 15 + 1]
 
     pytest.raises(IndexError, hm.get, (i + 1) * 30)
 
@@ -91,3 +96,123 @@ def test_housemodel_get_delta(hm, date, delta):
 
 def tets_housemodel_get_delta_error(hm):
     pytest.raises(ValueError, hm.get_delta, '2013-01-01')
+
+
+def test_housemodel_get_random_access(hm):
+    """Call get() backwards and in random order."""
+    for minutes in [135, 0, 60, 45, 60, 134, 15]:
+        ret = hm.get(minutes)
+        assert ret.tolist() == [minutes // 15, minutes // 15 + 1]
+
+    pytest.raises(IndexError, hm.get, -15)
+    pytest.raises(IndexError, hm.get, 150)
+    assert hm.get(30).tolist() == [2, 3]
+
+
+def test_housemodel_irregular_dates(tmp_path):
+    lines = open(data_file).read().splitlines()
+    del lines[-3]
+    path = tmp_path / 'irregular.data'
+    path.write_text('\n'.join(lines))
+    pytest.raises(ValueError, HouseModel, open(str(path)), 'spam')
+
+
+def test_profile_data_load(tmp_path):
+    data = ProfileData.load(data_file, str(tmp_path))
+    assert not isinstance(data.profiles, np.memmap)
+    assert len(list(tmp_path.iterdir())) == 3
+
+    cached = ProfileData.load(data_file, str(tmp_path))
+    assert isinstance(cached.profiles, np.memmap)
+    assert cached.meta == data.meta
+    assert dict(cached.id_lists) == data.id_lists
+    assert cached.attrs == data.attrs
+    assert cached.profiles.tolist() == data.profiles.tolist()
+
+    hm = HouseModel(cached, 'eggs')
+    assert hm.houses == scenario_b_houses
+    assert hm.get(30).tolist() == [p[2] for p in scenario_b_profiles]
+
+
+@pytest.mark.parametrize('module', ['gzip', 'lzma', 'bz2'])
+def test_open_profile_file(tmp_path, module):
+    """Compressed files are detected by their content, not their name."""
+    compress = __import__(module).compress
+    path = tmp_path / 'profiles.data'
+    content = open(data_file).read()
+    path.write_bytes(compress(content.encode()))
+    with open_profile_file(str(path)) as f:
+        assert f.read() == content
+
+
+@pytest.mark.parametrize('interpolation', ['linear', 'spline'])
+def test_housemodel_interpolation(interpolation):
+    hm = HouseModel(open(data_file), 'spam', interpolation)
+    # The test profiles are linear, so both interpolations are exact
+    for minutes in [0, 5, 7.5, 15, 100, 134]:
+        ret = hm.get(minutes)
+        assert ret.tolist() == pytest.approx([minutes / 15, minutes / 15 + 1])
+
+    # The last value is kept until the end of its interval
+    assert hm.get(140).tolist() == [9, 10]
+    pytest.raises(IndexError, hm.get, 150)
+
+
+def test_profile_data_coefficients():
+    data = ProfileData({}, {}, {}, np.array([[0.], [1.], [0.]]))
+    pytest.raises(ValueError, data.coefficients, 'cubic')
+
+    linear = data.coefficients('linear')
+    assert linear[:, :, 0].tolist() == [[0, 1, 0], [1, -1, 0]]
+
+    spline = data.coefficients('spline')
+    assert spline is data.coefficients('spline')
+    assert spline.shape == (4, 3, 1)
+    # Passes through all values with a tangent of 0 at the peak
+    u = np.array([0, .5, 1])
+    values = sum(spline[k, 0, 0] * u**k for k in range(4))
+    assert values.tolist() == [0, .625, 1]
+    assert spline[1, 1, 0] == 0
+
+
+@pytest.mark.parametrize('text', [
+    '{"spam": ["x", "y"], "eggs": ["a", "b"], "ham": []}',
+    '{\n"spam": ["x", "y"],\n"eggs": ["a", "b"],\n"ham": []\n}',
+    '{\n  "spam": [\n    "x",\n    "y"\n  ],\n  "eggs": [\n    "a",\n'
+    '    "b"\n  ],\n  "ham": []\n}',
+])
+def test_parse_id_lists(text):
+    lines = text.splitlines(keepends=True) + ['# attrs\n', 'num_hh, 1\n']
+    data = iter(lines)
+    assert parse_id_lists(data, ['spam', 'ham']) == {'spam': ['x', 'y'],
+                                                     'ham': []}
+    assert next(data) == 'num_hh, 1\n'
+    assert parse_id_lists(iter(lines)) == {
+        'spam': ['x', 'y'], 'eggs': ['a', 'b'], 'ham': []}
+
+    other = {}
+    assert parse_id_lists(iter(lines), ['ham'], other) == {'ham': []}
+    assert {grid: json.loads(text) for grid, text in other.items()} == {
+        'spam': ['x', 'y'], 'eggs': ['a', 'b']}
+
+
+@pytest.mark.parametrize('text', [
+    '["spam"]',
+    '{"spam": ["x"] "eggs": []}',
+    '{"spam": ["x"],',
+])
+def test_parse_id_lists_invalid(text):
+    pytest.raises(ValueError, parse_id_lists, iter([text, '# attrs']))
+
+
+def test_read_id_lists():
+    assert read_id_lists(data_file, ['eggs']) == {
+        'eggs': ['a', 'b', 'c', 'd', 'e']}
+    data = ProfileData.parse(open(data_file), ['spam'])
+    hm = HouseModel(data, 'spam')
+    assert hm.node_ids == ['x', 'y']
+    # Other grids are decoded on demand without reading the file again
+    assert data.id_lists.texts.keys() == {'eggs'}
+    assert HouseModel(data, 'eggs').node_ids == ['a', 'b', 'c', 'd', 'e']
+    assert not data.id_lists.texts
+    pytest.raises(KeyError, HouseModel, data, 'foo')
@@ -5,7 +5,7 @@ import pytest
 from householdsim import mosaik
 
 
-@pytest.mark.parametrize('data_file_ext', ['', '.gz'])
+@pytest.mark.parametrize('data_file_ext', ['', '.gz', '.lzma'])
 def test_init(data_file_ext):
     sim = mosaik.HouseholdSim()
     sim.init('sid', 1.)
@@ -23,6 +23,23 @@ def test_init(data_file_ext):
     ]
 
 
+def test_init_cache_profiles(tmp_path):
+    sim = mosaik.HouseholdSim()
+    sim.init('sid', 60., cache_profiles=True, cache_dir=str(tmp_path))
+
+    DATA_FILE = join(dirname(__file__), 'data', 'test.data.gz')
+    sim.create(1, 'ResidentialLoads', sim_start='2014-01-01 00:15:00',
+               profile_file=DATA_FILE, grid_name='spam')
+    assert len(list(tmp_path.iterdir())) == 3
+
+    sim.step(0, {}, 15)
+    data = sim.get_data({'House_0': ['P_out'], 'House_1': ['P_out']})
+    assert data == {
+        'House_0': {'P_out': 1},
+        'House_1': {'P_out': 2},
+    }
+
+
 def test_init_erros():
     sim = mosaik.HouseholdSim()
     sim.init('sid', 1.)
@@ -34,21 +51,69 @@ def test_init_erros():
                   profile_file='foobar',
                   grid_name='foo')
 
-    # Create to many instances
-    pytest.raises(ValueError, sim.create, 2, 'ResidentialLoads',
-                  sim_start='2014-01-01 00:00:00',
-                  profile_file=DATA_FILE,
-                  grid_name='eggs')
-
-    # Call create() twice
-    sim.create(1, 'ResidentialLoads',
-               sim_start='2014-01-01 00:00:00',
-               profile_file=DATA_FILE,
-               grid_name='eggs')
+    # Invalid grid name
     pytest.raises(ValueError, sim.create, 1, 'ResidentialLoads',
                   sim_start='2014-01-01 00:00:00',
                   profile_file=DATA_FILE,
-                  grid_name='eggs')
+                  grid_name='foo')
+
+
+def test_create_other_grid(monkeypatch):
+    sim = mosaik.HouseholdSim()
+    sim.init('sid', 60.)
+    kwargs = {'sim_start': '2014-01-01 00:00:00',
+              'profile_file': join(dirname(__file__), 'data', 'test.data')}
+    sim.create(1, 'ResidentialLoads', grid_name='spam', **kwargs)
+
+    # The ID lists of other grids are kept from the first pass
+    monkeypatch.setattr(mosaik.householdsim.model, 'open_profile_file', None)
+    entities = sim.create(1, 'ResidentialLoads', grid_name='eggs', **kwargs)
+    assert len(entities[0]['children']) == 5
+
+
+def test_create_multiple_sets():
+    sim = mosaik.HouseholdSim()
+    sim.init('sid', 60., pos_loads=False)
+    DATA_FILE = join(dirname(__file__), 'data', 'test.data')
+
+    entities = sim.create(2, 'ResidentialLoads',
+                          sim_start='2014-01-01 00:00:00',
+                          profile_file=DATA_FILE,
+                          grid_name='spam')
+    entities += sim.create(1, 'ResidentialLoads',
+                           sim_start='2014-01-01 00:00:00',
+                           profile_file=DATA_FILE,
+                           grid_name='eggs')
+    entities += sim.create(1, 'ResidentialLoads',
+                           sim_start='2014-01-01 00:30:00',
+                           profile_file=DATA_FILE + '.gz',
+                           grid_name='spam')
+    assert [(e['eid'], [c['eid'] for c in e['children']])
+            for e in entities] == [
+        ('resid_0', ['House_0', 'House_1']),
+        ('resid_1', ['House_2', 'House_3']),
+        ('resid_2', ['House_4', 'House_5', 'House_6', 'House_7', 'House_8']),
+        ('resid_3', ['House_9', 'House_10']),
+    ]
+    # All sets from one file share the parsed profiles
+    assert len(sim._file_cache) == 2
+    assert sim.models[0].profiles is sim.models[2].profiles
+
+    assert sim.step(15, {}, 60) == 30
+    data = sim.get_data({'House_%s' % i: ['P_out', 'num'] for i in range(11)})
+    assert data == {
+        'House_0': {'P_out': -1, 'num': 1},
+        'House_1': {'P_out': -2, 'num': 2},
+        'House_2': {'P_out': -1, 'num': 1},
+        'House_3': {'P_out': -2, 'num': 2},
+        'House_4': {'P_out': -1, 'num': 1},
+        'House_5': {'P_out': -2, 'num': 2},
+        'House_6': {'P_out': -3, 'num': 3},
+        'House_7': {'P_out': -1, 'num': 4},
+        'House_8': {'P_out': -2, 'num': 5},
+        'House_9': {'P_out': -3, 'num': 1},
+        'House_10': {'P_out': -4, 'num': 2},
+    }
 
 
 @pytest.mark.parametrize('time_resolution, next_step', [
@@ -91,6 +156,22 @@ def test_step_get_data(time_resolution, next_step):
     }
 
 
+@pytest.mark.parametrize('time_resolution', [.05, .1, .2, .9])
+def test_step_schedule(time_resolution):
+    sim = mosaik.HouseholdSim()
+    sim.init('sid', time_resolution)
+    sim.create(1, 'ResidentialLoads', sim_start='2014-01-01 00:00:00',
+               profile_file=join(dirname(__file__), 'data', 'test.data'),
+               grid_name='spam')
+
+    time = 0
+    for i in range(10):
+        time = sim.step(time, {}, 10**9)
+        assert time == int((i + 1) * 15 * 60 / time_resolution)
+        assert sim.get_data({'House_0': ['P_out']}) == {
+            'House_0': {'P_out': i}}
+
+
 def test_step_with_offset():
     sim = mosaik.HouseholdSim()
     sim.init('sid', 1., pos_loads=False)
@@ -110,3 +191,106 @@ def test_step_with_offset():
     }
 
     pytest.raises(IndexError, sim.step, 90 * 60, {}, 90*60)
+
+
+def test_step_interpolation():
+    sim = mosaik.HouseholdSim()
+    sim.init('sid', 60., interpolation='linear', step_size=5)
+    sim.create(1, 'ResidentialLoads',
+               sim_start='2014-01-01 00:00:00',
+               profile_file=join(dirname(__file__), 'data', 'test.data'),
+               grid_name='spam')
+
+    assert sim.step(0, {}, 150) == 5
+    assert sim.step(5, {}, 150) == 10
+    data = sim.get_data({'House_0': ['P_out'], 'House_1': ['P_out']})
+    assert data == {
+        'House_0': {'P_out': pytest.approx(1 / 3)},
+        'House_1': {'P_out': pytest.approx(4 / 3)},
+    }
+
+    pytest.raises(ValueError, sim.init, 'sid', 60., interpolation='cubic')
+
+
+def create_varied(variation, grid_name='eggs'):
+    sim = mosaik.HouseholdSim()
+    sim.init('sid', 60., variation=variation)
+    sim.create(1, 'ResidentialLoads',
+               sim_start='2014-01-01 00:30:00',
+               profile_file=join(dirname(__file__), 'data', 'test.data'),
+               grid_name=grid_name)
+    return sim
+
+
+def get_loads(sim, time):
+    sim.step(time, {}, 150)
+    data = sim.get_data({'House_%s' % i: ['P_out'] for i in range(5)})
+    return [data['House_%s' % i]['P_out'] for i in range(5)]
+
+
+def test_variation():
+    # Without variation parameters, the profiles stay the same
+    sim = create_varied({'seed': 1})
+    assert get_loads(sim, 15) == [3, 4, 5, 3, 4]
+
+    # Scaling factors and time shifts differ between houses
+    sim = create_varied({'seed': 1, 'shift': 15, 'scale': .2})
+    assert sim._shift.tolist() != [sim._shift[0]] * 5
+    assert sim._scale.tolist() != [sim._scale[0]] * 5
+    profiles = sim.models[0].profiles
+    expected = [profiles[(45 + shift) // 15, i % 3] * scale for i, (
+        shift, scale) in enumerate(zip(sim._shift, sim._scale))]
+    assert get_loads(sim, 15) == pytest.approx(expected)
+
+
+def test_variation_reproducible():
+    variation = {'seed': 42, 'shift': 30, 'scale': .1, 'noise': .05}
+    sim_a = create_varied(variation)
+    sim_b = create_varied(variation)
+    forward = [get_loads(sim_a, t) for t in range(0, 90, 15)]
+    backward = [get_loads(sim_b, t) for t in reversed(range(0, 90, 15))]
+    assert forward == backward[::-1]
+    assert forward[0] != forward[1]
+
+    sim_c = create_varied(dict(variation, seed=43))
+    assert get_loads(sim_c, 0) != forward[0]
+
+
+def test_variation_no_sign_change():
+    # Large deviations yield negative factors, which must be clipped
+    sim = create_varied({'seed': 3, 'scale': 2, 'noise': 2})
+    for time in range(0, 90, 15):
+        assert all(load >= 0 for load in get_loads(sim, time))
+    assert 0 in get_loads(sim, 15)
+
+
+def test_variation_errors():
+    sim = mosaik.HouseholdSim()
+    pytest.raises(ValueError, sim.init, 'sid', 60., variation={'spam': 1})
+
+
+def test_get_data_outputs_change():
+    sim = mosaik.HouseholdSim()
+    sim.init('sid', 60.)
+    sim.create(1, 'ResidentialLoads',
+               sim_start='2014-01-01 00:00:00',
+               profile_file=join(dirname(__file__), 'data', 'test.data'),
+               grid_name='spam')
+
+    sim.step(0, {}, 150)
+    outputs = {'House_0': ['P_out'], 'House_1': ['num_hh', 'node_id']}
+    assert sim.get_data(outputs) == {
+        'House_0': {'P_out': 0},
+        'House_1': {'num_hh': 2, 'node_id': 'y'},
+    }
+    plan = sim._output_plan
+    assert sim.get_data(outputs) == sim.get_data(dict(outputs))
+    assert sim._output_plan is plan
+
+    sim.step(15, {}, 150)
+    outputs['House_1'].append('P_out')
+    assert sim.get_data(outputs) == {
+        'House_0': {'P_out': 1},
+        'House_1': {'num_hh': 2, 'node_id': 'y', 'P_out': 2},
+    }
+    assert sim._output_plan is not plan
@@ -2,19 +2,34 @@
 Mosaik API for simulations written in Python.
 
 """
+from array import array
+import functools
 import inspect
 import logging
+import os
 import re
 import socket
+import struct
 import sys
 import traceback
 
 from simpy._compat import PY2
+from simpy.events import Event
+from simpy.io import codec
 from simpy.io import select as backend
-from simpy.io.packet import PacketUTF8 as Packet
+from simpy.io.packet import Packet
 from simpy.io.message import Message
 import docopt
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
+
 
 if PY2:
     ConnectionError = socket.error
@@ -40,6 +55,11 @@ Options:
                 Timeout in seconds for mosaik handshake [default: 60]
 %(extra_opts)s
 """
+SIM_ID_ENV = 'MOSAIK_SIM_ID'  # Set by mosaik if we must identify ourselves
+COLUMNAR_KEY = '__columnar__'  # Marks responses of Simulator.columnar_data()
+_FLOAT_ARRAY = 1  # msgpack ext type code for raw float64 buffers
+_SHM_REF = b'\x00'  # First byte of packets pointing into a shared memory ring
+_SHM_REF_FORMAT = struct.Struct('!QL')  # Offset and size of the payload
 _LOG_LEVELS = {
     'debug': logging.DEBUG,
     'info': logging.INFO,
@@ -117,6 +137,9 @@ class Simulator(object):
     time_resolution = None  # Will be set by "init()"
     """The time resolution of the scenario."""
 
+    # Entity IDs and columns of the last "columnar_data()" response
+    _columnar_state = (None, None)
+
     def __init__(self, meta):
         self.meta = {
             'api_version': __api_version__,
@@ -255,6 +278,70 @@ class Simulator(object):
         """
         raise NotImplementedError
 
+    def columnar_data(self, data, delta=False):
+        """Return the :meth:`get_data()` response *data* in a columnar format
+        that mosaik expands back into the usual one.
+
+        Instead of one dict per entity, the result contains the list of entity
+        IDs (only if it differs from the previous call) and a list of values
+        per attribute. If *delta* is set and the requested entities and
+        attributes are the same as in the previous call, the columns only
+        contain the values that changed since then::
+
+            def get_data(self, outputs):
+                data = {eid: {attr: ... for attr in attrs}
+                        for eid, attrs in outputs.items()}
+                return self.columnar_data(data, delta=True)
+
+        This saves a lot of bytes for simulators with many entities whose
+        values rarely change.
+
+        """
+        result = {}
+        eids = []
+        columns = {}
+        for eid, values in data.items():
+            if eid == 'time':
+                result['time'] = values
+                continue
+            i = len(eids)
+            eids.append(eid)
+            for attr, value in values.items():
+                try:
+                    column = columns[attr]
+                except KeyError:
+                    column = columns[attr] = ([], [])
+                column[0].append(i)
+                column[1].append(value)
+
+        prev_eids, prev_columns = self._columnar_state
+        self._columnar_state = (eids, columns)
+        message = {}
+        if eids != prev_eids:
+            message['eids'] = eids
+        same_layout = (eids == prev_eids and
+                       columns.keys() == prev_columns.keys() and
+                       all(idx == prev_columns[attr][0]
+                           for attr, (idx, values) in columns.items()))
+        if delta and same_layout:
+            changes = {}
+            for attr, (idx, values) in columns.items():
+                old = prev_columns[attr][1]
+                changed = [pos for pos, (value, old_value)
+                           in enumerate(zip(values, old))
+                           if value != old_value]
+                if changed:
+                    changes[attr] = [changed, [values[pos] for pos in changed]]
+            message['delta'] = changes
+        else:
+            # Don't send the indices for attributes that all entities have:
+            message['columns'] = {
+                attr: [None if len(idx) == len(eids) else idx, values]
+                for attr, (idx, values) in columns.items()
+            }
+        result[COLUMNAR_KEY] = message
+        return result
+
     def configure(self, args, backend, env):
         """This method can be overridden to configure the simulation with the
         command line *args* as created by `docopt <http://docopt.org/>`_.
@@ -290,6 +377,258 @@ class Simulator(object):
         pass
 
 
+class JSONCodec(object):
+    """Message codec that sends UTF-8 encoded JSON.
+
+    This is the wire format every simulator understands and the one each
+    connection starts with. *json_codec* is the :mod:`simpy.io.codec` JSON
+    codec that does the actual work.
+
+    """
+    name = 'json'
+
+    def __init__(self, json_codec=None):
+        if json_codec is None:
+            json_codec = codec.JSON()
+        self.json_codec = json_codec
+
+    def encode(self, obj):
+        return self.json_codec.encode(obj).encode('utf-8')
+
+    def decode(self, data):
+        return self.json_codec.decode(data.decode('utf-8'))
+
+
+class MsgpackCodec(object):
+    """Binary message codec based on `msgpack <https://msgpack.org/>`_.
+
+    NumPy float arrays and ``array('d')`` objects are packed as raw float64
+    buffers and come out as lists on the other side. Other NumPy arrays and
+    scalars are converted to their Python equivalents.
+
+    """
+    name = 'msgpack'
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError('The msgpack codec requires the "msgpack" '
+                              'package')
+
+    def encode(self, obj):
+        try:
+            return msgpack.packb(obj, default=_pack_ext, use_bin_type=True)
+        except BaseException:
+            raise ValueError('Failed to encode "%s"' % str(obj))
+
+    def decode(self, data):
+        try:
+            return msgpack.unpackb(data, ext_hook=_unpack_ext, raw=False,
+                                   strict_map_key=False)
+        except BaseException:
+            raise ValueError('Failed to decode "%s"' % str(data))
+
+
+def _pack_ext(obj):
+    if type(obj) is array and obj.typecode == 'd':
+        if sys.byteorder == 'big':
+            obj = array('d', obj)
+            obj.byteswap()
+        return msgpack.ExtType(_FLOAT_ARRAY, obj.tobytes())
+    if type(obj).__module__ == 'numpy':
+        if getattr(obj, 'ndim', 0) == 1 and obj.dtype.kind == 'f':
+            return msgpack.ExtType(_FLOAT_ARRAY, obj.astype('<f8').tobytes())
+        return obj.tolist()
+    raise TypeError('Cannot encode objects of type %s' % type(obj).__name__)
+
+
+def _unpack_ext(code, data):
+    if code != _FLOAT_ARRAY:
+        return msgpack.ExtType(code, data)
+    values = array('d')
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tolist()
+
+
+CODECS = {
+    JSONCodec.name: JSONCodec,
+    MsgpackCodec.name: MsgpackCodec,
+}
+"""Message codecs by name. *json* is always available."""
+
+
+def available_codecs():
+    """Return the names of the codecs usable in this process, the preferred
+    one first.
+
+    """
+    names = []
+    if msgpack is not None:
+        names.append(MsgpackCodec.name)
+    names.append(JSONCodec.name)
+    return names
+
+
+def available_transports():
+    """Return the names of the extra transports usable in this process.
+
+    Plain TCP is always available and not included in the list.
+
+    """
+    return ['shm'] if shared_memory is not None else []
+
+
+class SharedMemoryRing(object):
+    """Byte ring buffer in a :mod:`multiprocessing.shared_memory` segment
+    with exactly one writer and one reader process.
+
+    The writer stores payloads with :meth:`put()` and sends their offset to
+    the reader over the socket. The reader fetches them with :meth:`get()`
+    in the same order and publishes how far it has read in the segment's
+    header, so that the writer knows which space it may reuse.
+
+    Use :meth:`create()` in the owning process and :meth:`attach()` in the
+    other one.
+
+    """
+    _header = struct.Struct('<QQ')  # Capacity and read position
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.capacity = self._header.unpack_from(shm.buf)[0]
+        self._head = 0
+
+    @classmethod
+    def create(cls, capacity):
+        size = cls._header.size + capacity
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        if hasattr(os, 'posix_fallocate'):
+            # The segment's pages are only allocated when they are first
+            # written. Reserve them now, so that a full tmpfs raises an
+            # OSError here instead of killing the process with SIGBUS later.
+            try:
+                os.posix_fallocate(shm._fd, 0, size)
+            except OSError:
+                shm.close()
+                shm.unlink()
+                raise
+        cls._header.pack_into(shm.buf, 0, capacity, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name)
+            # Only the owner may unlink the segment. Stop the resource
+            # tracker from doing so when this process exits.
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def put(self, data):
+        """Copy *data* into the ring and return its offset.
+
+        Return ``None`` if the reader has not yet released enough space.
+
+        """
+        size = len(data)
+        head = self._head
+        pos = head % self.capacity
+        if pos + size > self.capacity:
+            # Payloads never wrap around, skip the rest of the ring instead.
+            head += self.capacity - pos
+            pos = 0
+        tail = self._header.unpack_from(self.shm.buf)[1]
+        if head + size - tail > self.capacity:
+            return None
+
+        start = self._header.size + pos
+        self.shm.buf[start:start + size] = data
+        self._head = head + size
+        return head
+
+    def get(self, offset, size):
+        """Return the *size* bytes put into the ring at *offset* and release
+        them and everything before them.
+
+        """
+        start = self._header.size + offset % self.capacity
+        data = bytes(self.shm.buf[start:start + size])
+        self._header.pack_into(self.shm.buf, 0, self.capacity, offset + size)
+        return data
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedMemoryPacket(Packet):
+    """Packet transport that moves large payloads through a pair of
+    :class:`SharedMemoryRing` objects and only sends their location over the
+    socket.
+
+    Until :meth:`attach()` is called, it behaves exactly like
+    :class:`~simpy.io.packet.Packet`. Payloads smaller than *threshold* bytes
+    or that don't fit into the ring are always sent over the socket.
+
+    """
+    def __init__(self, socket, max_packet_size=16384, blocksize=4096,
+                 threshold=16384):
+        Packet.__init__(self, socket, max_packet_size, blocksize)
+        self.threshold = threshold
+        self.send_ring = None
+        self.recv_ring = None
+
+    def attach(self, send_ring, recv_ring):
+        self.send_ring = send_ring
+        self.recv_ring = recv_ring
+
+    def detach(self):
+        """Close the rings and continue with the socket only."""
+        for ring in (self.send_ring, self.recv_ring):
+            if ring is not None:
+                ring.close()
+        self.send_ring = self.recv_ring = None
+
+    def read(self):
+        event = Event(self.env)
+        Packet.read(self).callbacks.append(
+            functools.partial(self._read_ring, event))
+        return event
+
+    def _read_ring(self, event, packet_ev):
+        if not packet_ev.ok:
+            packet_ev.defused = True
+            event.fail(packet_ev.value)
+            return
+
+        data = packet_ev.value
+        # Neither codec ever produces a leading null byte:
+        if self.recv_ring is not None and data[:1] == _SHM_REF:
+            offset, size = _SHM_REF_FORMAT.unpack_from(data, 1)
+            data = self.recv_ring.get(offset, size)
+        event.succeed(data)
+
+    def write(self, packet):
+        if self.send_ring is not None and len(packet) >= self.threshold:
+            offset = self.send_ring.put(packet)
+            if offset is not None:
+                packet = _SHM_REF + _SHM_REF_FORMAT.pack(offset, len(packet))
+        return Packet.write(self, packet)
+
+    def close(self):
+        self.detach()
+        Packet.close(self)
+
+
 class MosaikProxy(object):
     exposed_meths = [
         'get_progress',
@@ -366,7 +705,14 @@ def start_simulation(simulator, description='', extra_options=None):
             sock = env.run(until=env.process(greeter()))
         else:
             sock = backend.TCPSocket.connection(env, addr)
-        sock = Message(env, Packet(sock, max_packet_size=10*1024*1024))
+        packet = SharedMemoryPacket(sock, max_packet_size=10*1024*1024)
+        sim_id = os.environ.get(SIM_ID_ENV)
+        if sim_id is not None and not remote_flag:
+            # Mosaik started several simulators at once and accepts their
+            # connections in any order, so tell it who we are.
+            env.run(until=packet.write(
+                JSONCodec().encode(['identify', sim_id])))
+        sock = Message(env, packet, JSONCodec())
         simulator.mosaik = MosaikProxy(sock)
         proc = env.process(init(sock, simulator))
         env.run(until=proc)
@@ -434,7 +780,11 @@ def init(channel, sim):
     if not api_compliant:
         kwargs.pop('time_resolution')
     ret = yield init_func(*args, **kwargs)
-    request.succeed(ret)
+    # Tell mosaik which codecs and transports we understand (it may switch to
+    # one of them with a "set_codec" or "set_transport" call) and that it may
+    # send us "batch" calls.
+    request.succeed(dict(ret, codecs=available_codecs(),
+                         transports=available_transports(), batch=True))
 
 
 def run(channel, sim):
@@ -460,6 +810,16 @@ def run(channel, sim):
     for name, func in funcs.items():
         funcs[name] = get_wrapper(func, channel.env)
 
+    def batch(calls):
+        """Perform a list of ``[func, args, kwargs]`` calls in order and
+        return the list of their results."""
+        results = []
+        for name, args, kwargs in calls:
+            results.append((yield funcs[name](*args, **kwargs)))
+        return results
+
+    funcs['batch'] = get_wrapper(batch, channel.env)
+
     logger.debug('Entering event loop ...')
     while True:
         request = yield channel.recv()
@@ -467,12 +827,44 @@ def run(channel, sim):
         logger.debug('Calling %s(*%s, **%s)' % (func, args, kwargs))
         if func == 'stop':
             break
+        if func == 'set_codec':
+            new_codec = CODECS[args[0]]()
+            request.succeed(new_codec.name)
+            # The reply still has to be encoded with the old codec:
+            request.callbacks.append(functools.partial(_set_codec, channel,
+                                                       new_codec))
+            continue
+        if func == 'set_transport':
+            try:
+                _set_transport(channel, *args)
+            except Exception as exc:
+                # Mosaik falls back to plain TCP.
+                request.fail(exc)
+            else:
+                request.succeed(args[0])
+            continue
 
         func = funcs[func]
         ret = yield func(*args, **kwargs)
         request.succeed(ret)
 
 
+def _set_codec(channel, new_codec, event):
+    channel.codec = new_codec
+
+
+def _set_transport(channel, transport, recv_name, send_name):
+    if transport != 'shm':
+        raise ValueError('Unknown transport "%s"' % transport)
+    recv_ring = SharedMemoryRing.attach(recv_name)
+    try:
+        send_ring = SharedMemoryRing.attach(send_name)
+    except BaseException:
+        recv_ring.close()
+        raise
+    channel.socket.attach(send_ring, recv_ring)
+
+
 def get_wrapper(func, env):
     if inspect.isgeneratorfunction(func):
         def wrapper(*args, **kwargs):
@@ -16,6 +16,7 @@ import collections
 import copy
 import heapq as hq
 import importlib
+import json
 import os
 import shlex
 import subprocess
@@ -23,8 +24,8 @@ import sys
 from loguru import logger
 
 from simpy.io import select as backend
-from simpy.io.packet import PacketUTF8 as Packet
 from simpy.io.json import JSON as JSON_RPC  # JSON is actually an object
+from simpy.io.network import RemoteException
 from mosaik import _version
 import mosaik_api
 
@@ -42,6 +43,9 @@ API_MINOR = _version.VERSION_INFO[1]  # Current minor version of the sim API
 API_VERSION = '%s.%s' % (API_MAJOR, API_MINOR)  # Current version of the API
 FULL_ID_SEP = '.'  # Separator for full entity IDs
 FULL_ID = '%s.%s'  # Template for full entity IDs ('sid.eid')
+# Default size of each shared memory ring. Payloads are limited by the
+# "max_packet_size" of the connection (10 MiB), so a few of them fit.
+SHM_SIZE = 16 * 1024 * 1024
 
 
 def start(
@@ -66,6 +70,7 @@ def start(
             'ExampleSimB': {
                 'cmd': 'example_sim %(addr)s',
                 'cwd': '.',
+                'codec': 'json',
             },
             'ExampleSimC': {
                 'connect': 'host:port',
@@ -79,6 +84,13 @@ def start(
     *ExampleSimB* would be started by executing the command *example_sim* and
     passing the network address of mosaik das command line argument. You can
     optionally specify a *current working directory*. It defaults to ``.``.
+    Remote simulators talk to mosaik in the best wire format both sides
+    support (see :func:`select_codec`); the optional *codec* entry restricts
+    that choice to a single format. Large messages to and from *cmd*
+    simulators go through shared memory unless their *transport* entry is
+    ``'tcp'``; the ring size can be set via ``world.config['shm_size']``.
+    With ``'parallel': True``, :func:`start_parallel()` launches the *cmd*
+    simulator together with the other parallel ones.
 
     *ExampleSimC* can not be started by mosaik, so mosaik tries to connect to
     it.
@@ -112,21 +124,145 @@ def start(
         if sim_type in sim_config:
             proxy = start(world, sim_name, sim_config, sim_id, time_resolution,
                           sim_params)
-            try:
-                proxy.meta['api_version'] = validate_api_version(  # type: ignore
-                    proxy.meta['api_version'])
-                type_check(proxy.meta, sim_name, sim_id)
-                proxy.meta = expand_meta(proxy.meta, sim_name)
-                return proxy
-            except ScenarioError as se:
-                raise ScenarioError('Simulator "%s" could not be started:'
-                                    ' Invalid version "%s": %s' %
-                                    (sim_name, proxy.meta['api_version'], se))
+            return check_proxy(proxy, sim_name, sim_id)
     else:
         raise ScenarioError('Simulator "%s" could not be started: '
                             'Invalid configuration' % sim_name)
 
 
+def start_parallel(
+    world: World,
+    sims: Iterable[Tuple[str, SimId, Dict[str, Any]]],
+    time_resolution: float,
+) -> Dict[SimId, SimProxy]:
+    """
+    Start all simulators in *sims*, a list of ``(sim_name, sim_id,
+    sim_params)`` tuples, like :func:`start()` but without waiting for each
+    *cmd* simulator with ``'parallel': True`` in its sim config before
+    launching the next one.
+
+    The other simulators are started one after another first. Then the
+    processes of the parallel ones are spawned at once. Each one gets its
+    sim ID via the :data:`mosaik_api.SIM_ID_ENV` environment variable and
+    sends it back right after connecting, so mosaik can accept the
+    connections in any order. The ``init()`` handshakes run concurrently,
+    too. Simulators that don't identify themselves (e.g., because they use
+    an older mosaik API) must not be marked as parallel.
+
+    Return a dict mapping the sim IDs to :class:`SimProxy` instances in the
+    order of *sims*.
+
+    Raise a :exc:`~mosaik.exceptions.ScenarioError` if a simulator cannot be
+    started.
+    """
+    sims = list(sims)
+    starters = StarterCollection()
+    parallel = set()
+    for sim_name, sim_id, sim_params in sims:
+        try:
+            sim_config = world.sim_config[sim_name]
+        except KeyError:
+            raise ScenarioError('Simulator "%s" could not be started: Not '
+                                'found in sim_config' % sim_name)
+        sim_type = next((t for t in starters if t in sim_config), None)
+        if (sim_type == 'cmd' and starters['cmd'] is start_proc and
+                sim_config.get('parallel', False)):
+            parallel.add(sim_id)
+
+    # Serial cmd simulators accept connections on the same server socket,
+    # so they must be done before the parallel ones start connecting.
+    proxies = {}
+    for sim_name, sim_id, sim_params in sims:
+        if sim_id not in parallel:
+            proxies[sim_id] = start(world, sim_name, sim_id, time_resolution,
+                                    sim_params)
+
+    procs = {}
+
+    def terminate():
+        for proc in procs.values():
+            terminate_proc(proc)
+
+    try:
+        for sim_name, sim_id, sim_params in sims:
+            if sim_id in parallel:
+                procs[sim_id] = spawn_proc(world, sim_name,
+                                           world.sim_config[sim_name],
+                                           sim_params,
+                                           {mosaik_api.SIM_ID_ENV: sim_id})
+    except BaseException:
+        terminate()
+        raise
+
+    start_timeout = world.env.timeout(world.config['start_timeout'])
+    names = {sim_id: (sim_name, sim_params)
+             for sim_name, sim_id, sim_params in sims}
+
+    def greeter():
+        greeters = []
+        while len(greeters) < len(procs):
+            accept_con = world.srv_sock.accept()
+            results = yield accept_con | start_timeout
+            if start_timeout in results:
+                missing = set(procs) - {sim_id for sim_id, _ in greeters}
+                raise SimulationError('Simulators %s did not connect to '
+                                      'mosaik in time.' %
+                                      ', '.join(sorted(missing)))
+
+            packet = mosaik_api.SharedMemoryPacket(
+                results[accept_con], max_packet_size=10 * 1024 * 1024)
+            identify = packet.read()
+            results = yield identify | start_timeout
+            if start_timeout in results:
+                raise SimulationError('A simulator did not identify itself in '
+                                      'time. Parallel simulators need '
+                                      'mosaik_api %s or newer.' %
+                                      mosaik_api.__version__)
+            try:
+                func, sim_id = json.loads(results[identify].decode('utf-8'))
+                assert func == 'identify' and sim_id in procs
+            except Exception:
+                raise SimulationError('A simulator sent an invalid '
+                                      'identification: %r' %
+                                      results[identify]) from None
+
+            sim_name, sim_params = names[sim_id]
+            greeters.append((sim_id, world.env.process(greet(
+                world, sim_name, world.sim_config[sim_name], sim_id,
+                time_resolution, sim_params, packet, procs[sim_id],
+                start_timeout))))
+
+        remote = {}
+        for sim_id, process in greeters:
+            remote[sim_id] = yield process
+        return remote
+
+    if procs:
+        remote = sync_process(greeter(), world, errback=terminate)
+        for sim_id, proxy in remote.items():
+            proxies[sim_id] = check_proxy(proxy, names[sim_id][0], sim_id)
+
+    return {sim_id: proxies[sim_id] for _, sim_id, _ in sims}
+
+
+def check_proxy(proxy: SimProxy, sim_name: str, sim_id: SimId) -> SimProxy:
+    """
+    Validate and expand the meta data of the freshly started *proxy*.
+
+    Raise a :exc:`~mosaik.exceptions.ScenarioError` if it is invalid.
+    """
+    try:
+        proxy.meta['api_version'] = validate_api_version(  # type: ignore
+            proxy.meta['api_version'])
+        type_check(proxy.meta, sim_name, sim_id)
+        proxy.meta = expand_meta(proxy.meta, sim_name)
+        return proxy
+    except ScenarioError as se:
+        raise ScenarioError('Simulator "%s" could not be started:'
+                            ' Invalid version "%s": %s' %
+                            (sim_name, proxy.meta['api_version'], se))
+
+
 def start_inproc(
     world: World,
     sim_name: str,
@@ -205,6 +341,26 @@ def start_proc(
     Raise a :exc:`~mosaik.exceptions.ScenarioError` if the simulator cannot be
     instantiated.
     """
+    proc = spawn_proc(world, sim_name, sim_config, sim_params)
+    proxy = make_proxy(world, sim_name, sim_config, sim_id, time_resolution,
+                       sim_params, proc=proc)
+    return proxy
+
+
+def spawn_proc(
+    world: World,
+    sim_name: str,
+    sim_config: Dict[Literal['cmd', 'cwd', 'env'], str],
+    sim_params: Dict[str, Any],
+    env_vars: Optional[Dict[str, str]] = None,
+) -> subprocess.Popen:
+    """
+    Launch the process for simulator *sim_name* based on its config entry
+    *sim_config* and return it. *env_vars* are added to its environment.
+
+    Raise a :exc:`~mosaik.exceptions.ScenarioError` if the process cannot be
+    launched.
+    """
     replacements = {
         'addr': '%s:%s' % (world.config['addr'][0], world.config['addr'][1]),
         'python': sys.executable,
@@ -220,7 +376,10 @@ def start_proc(
     # Make a copy of the current env. vars dictionary and update it with the
     # user provided values (or an empty dict as a default):
     env = dict(os.environ)
+    # Only simulators started by "start_parallel()" need to identify:
+    env.pop(mosaik_api.SIM_ID_ENV, None)
     env.update(sim_config.get('env', {}))  # type: ignore
+    env.update(env_vars or {})
 
     kwargs = {
         'bufsize': 1,
@@ -241,9 +400,7 @@ def start_proc(
         raise ScenarioError('Simulator "%s" could not be started: %s'
                             % (sim_name, eout)) from None
 
-    proxy = make_proxy(world, sim_name, sim_config, sim_id, time_resolution,
-                       sim_params, proc=proc)
-    return proxy
+    return proc
 
 
 def start_connect(
@@ -311,37 +468,143 @@ def make_proxy(world, sim_name, sim_config, sim_id, time_resolution,
                                       'Could not connect to "%s"' %
                                       (sim_name, sim_config['connect']))
 
-        rpc_con = JSON_RPC(Packet(sock, max_packet_size=10 * 1024 * 1024))
+        packet = mosaik_api.SharedMemoryPacket(
+            sock, max_packet_size=10 * 1024 * 1024)
+        return (yield from greet(world, sim_name, sim_config, sim_id,
+                                 time_resolution, sim_params, packet, proc,
+                                 start_timeout))
+
+    # Add a error callback that waits for "proc" to stop if "proc" is not None:
+    def terminate():
+        terminate_proc(proc)
+
+    cb = None if proc is None else terminate
+    return sync_process(greeter(), world, errback=cb)
+
 
-        # Make init() API call and wait for sim_name's meta data.
-        init = rpc_con.remote.init(sim_id, time_resolution=time_resolution,
-                                   **sim_params)
+def greet(world, sim_name, sim_config, sim_id, time_resolution, sim_params,
+          packet, proc, start_timeout):
+    """
+    Perform the ``init()`` API call over the freshly connected *packet*
+    socket and negotiate the codec and transport.
+
+    Return a new :class:`RemoteProcess` sim proxy.
+
+    This method is a SimPy process used by :func:`make_proxy()` and
+    :func:`start_parallel()`.
+    """
+    rpc_con = JSON_RPC(packet)
+    rpc_con.message.codec = mosaik_api.JSONCodec(rpc_con.codec)
+
+    # Make init() API call and wait for sim_name's meta data.
+    init = rpc_con.remote.init(sim_id, time_resolution=time_resolution,
+                               **sim_params)
+    try:
+        results = yield init | start_timeout
+    except ConnectionError as e:
+        raise SimulationError('Simulator "%s" closed its connection during'
+                              ' the init() call.' % sim_name, e)
+
+    if start_timeout in results:
+        raise SimulationError('Simulator "%s" did not reply to the init() '
+                              'call in time.' % sim_name)
+    else:
+        meta = results[init]
+
+    # Switch to a binary codec if the simulator offered one we know:
+    codec = select_codec(meta.pop('codecs', []), sim_config.get('codec'))
+    if codec != mosaik_api.JSONCodec.name:
+        set_codec = rpc_con.remote.set_codec(codec)
         try:
-            results = yield init | start_timeout
+            results = yield set_codec | start_timeout
         except ConnectionError as e:
-            raise SimulationError('Simulator "%s" closed its connection during'
-                                  ' the init() call.' % sim_name, e)
-
+            raise SimulationError('Simulator "%s" closed its connection '
+                                  'during the set_codec() call.'
+                                  % sim_name, e)
         if start_timeout in results:
-            raise SimulationError('Simulator "%s" did not reply to the init() '
-                                  'call in time.' % sim_name)
-        else:
-            meta = results[init]
+            raise SimulationError('Simulator "%s" did not reply to the '
+                                  'set_codec() call in time.' % sim_name)
+        rpc_con.message.codec = mosaik_api.CODECS[codec]()
 
-        return RemoteProcess(sim_name, sim_id, meta, proc, rpc_con, world)
+    # Simulators started by us run on the same host and can exchange
+    # large payloads via shared memory:
+    transports = meta.pop('transports', [])
+    if (proc and 'shm' in transports and
+            'shm' in mosaik_api.available_transports() and
+            sim_config.get('transport', 'shm') == 'shm'):
+        yield from set_transport(world, sim_name, sim_id, rpc_con,
+                                 start_timeout)
 
-    # Add a error callback that waits for "proc" to stop if "proc" is not None:
-    def terminate():
-        try:
-            # See if it terminates on its own ...
-            proc.wait(timeout=1)
-        except subprocess.TimeoutExpired:
-            # ... or kill it ...
-            proc.terminate()
-            proc.wait(timeout=1)
+    return RemoteProcess(sim_name, sim_id, meta, proc, rpc_con, world)
 
-    cb = None if proc is None else terminate
-    return sync_process(greeter(), world, errback=cb)
+
+def set_transport(world, sim_name, sim_id, rpc_con, start_timeout):
+    """
+    Try to move large payloads of *rpc_con* to shared memory rings and keep
+    using TCP only if that fails.
+    """
+    size = world.config.get('shm_size', SHM_SIZE)
+    rings = []
+    try:
+        for _ in range(2):
+            rings.append(mosaik_api.SharedMemoryRing.create(size))
+    except OSError as e:
+        for ring in rings:
+            ring.close()
+        logger.warning('Could not create shared memory for simulator '
+                       '"{sim_id}", using TCP: {error}', sim_id=sim_id,
+                       error=e)
+        return
+    to_sim, to_mosaik = rings
+
+    # Nothing else is in flight yet, so we can attach right away.
+    rpc_con.socket.attach(to_sim, to_mosaik)
+    request = rpc_con.remote.set_transport('shm', to_sim.name,
+                                           to_mosaik.name)
+    try:
+        results = yield request | start_timeout
+    except RemoteException as e:
+        rpc_con.socket.detach()
+        logger.warning('Simulator "{sim_id}" could not attach to shared '
+                       'memory, using TCP:\n{error}', sim_id=sim_id,
+                       error=e.remote_traceback)
+        return
+    except ConnectionError as e:
+        raise SimulationError('Simulator "%s" closed its connection '
+                              'during the set_transport() call.'
+                              % sim_name, e)
+    if start_timeout in results:
+        raise SimulationError('Simulator "%s" did not reply to the '
+                              'set_transport() call in time.' % sim_name)
+
+
+def terminate_proc(proc):
+    """
+    Wait for the simulator process *proc* to stop and kill it if it does not.
+    """
+    try:
+        # See if it terminates on its own ...
+        proc.wait(timeout=1)
+    except subprocess.TimeoutExpired:
+        # ... or kill it ...
+        proc.terminate()
+        proc.wait(timeout=1)
+
+
+def select_codec(offered: Iterable[str], wanted: Optional[str] = None) -> str:
+    """
+    Return the name of the codec to use for a remote simulator that
+    *offered* the given codec names, most preferred first.
+
+    Pick the first offered codec that is also available in this process or
+    *wanted* if it is given and both sides support it. Fall back to ``json``,
+    which every simulator understands.
+    """
+    available = mosaik_api.available_codecs()
+    for name in offered:
+        if name in available and wanted in (None, name):
+            return name
+    return mosaik_api.JSONCodec.name
 
 
 def validate_api_version(
@@ -642,8 +905,18 @@ class LocalProcess(SimProxy):
                                          self._world.env)
             for name in methods
         }
-        Proxy = type('Proxy', (), proxy_dict)
-        return Proxy
+        env = self._world.env
+
+        def run_batch(calls):
+            results = []
+            for name, args, kwargs in calls:
+                results.append((yield proxy_dict[name](*args, **kwargs)))
+            return results
+
+        def batch(calls):
+            return env.process(run_batch(calls))
+
+        return make_proxy_type(proxy_dict, batch, env)
 
 
 class RemoteProcess(SimProxy):
@@ -656,6 +929,7 @@ class RemoteProcess(SimProxy):
         self._rpc_con = rpc_con
         self._mosaik_remote = MosaikRemote(world, sid)
         self._stop_timeout = world.config['stop_timeout']
+        self._batch = meta.pop('batch', False)
         rpc_con.router = self._mosaik_remote.rpc
         super().__init__(name, sid, meta, world)
 
@@ -678,12 +952,133 @@ class RemoteProcess(SimProxy):
 
         if self._proc:
             self._proc.wait()
+        self._rpc_con.socket.detach()
 
     def _get_proxy(self, methods):
         """
         Return a proxy object for the remote simulator.
         """
-        return self._rpc_con.remote
+        env = self._world.env
+        remote = self._rpc_con.remote
+        proxy_dict = {name: getattr(remote, name) for name in methods}
+
+        if self._batch:
+            # One request and one reply for all calls
+            batch = remote.batch
+        else:
+            # The simulator handles requests in order, so we can send them
+            # all at once and wait for the replies.
+            def batch(calls):
+                events = [getattr(remote, name)(*args, **kwargs)
+                          for name, args, kwargs in calls]
+                return map_event(env.all_of(events), lambda results: [
+                    results[event] for event in events], env)
+
+        return make_proxy_type(proxy_dict, batch, env)
+
+
+def map_event(event, func, env):
+    """
+    Return a new event that succeeds with ``func(value)`` once *event*
+    succeeded with *value*, or fails like *event*.
+    """
+    result = env.event()
+
+    def callback(event):
+        if not event.ok:
+            event.defused = True
+            result.fail(event.value)
+            return
+        try:
+            value = func(event.value)
+        except Exception as e:
+            result.fail(e)
+        else:
+            result.succeed(value)
+
+    event.callbacks.append(callback)
+    return result
+
+
+def make_proxy_type(proxy_dict, batch, env):
+    """
+    Return a proxy type with the API methods in *proxy_dict* plus
+    ``batch()`` and ``step_get_data()``.
+
+    *batch* performs a list of ``[method, args, kwargs]`` calls in order and
+    returns an event with the list of their raw results.
+
+    ``get_data()``, ``batch()`` and ``step_get_data()`` expand
+    :meth:`mosaik_api.Simulator.columnar_data()` responses into the usual
+    nested format. ``step_get_data(time, inputs, max_advance, outputs)``
+    yields a ``(next_step, data)`` tuple.
+    """
+    decoder = ColumnarDecoder()
+    get_data = proxy_dict['get_data']
+
+    def expand_get_data(outputs):
+        return map_event(get_data(outputs), decoder.decode, env)
+
+    def expand_batch(calls):
+        # All get_data() results must pass the decoder in order, because
+        # later responses may only contain the changes since earlier ones.
+        return map_event(batch(calls), lambda results: [
+            decoder.decode(result) if name == 'get_data' else result
+            for (name, _, _), result in zip(calls, results)], env)
+
+    def step_get_data(time, inputs, max_advance, outputs):
+        calls = [
+            ['step', [time, inputs, max_advance], {}],
+            ['get_data', [outputs], {}],
+        ]
+        return map_event(expand_batch(calls), tuple, env)
+
+    proxy_dict = dict(proxy_dict, get_data=expand_get_data,
+                      batch=expand_batch, step_get_data=step_get_data)
+    return type('Proxy', (), proxy_dict)
+
+
+class ColumnarDecoder:
+    """
+    Expands the :meth:`mosaik_api.Simulator.columnar_data()` responses of one
+    simulator.
+
+    It remembers the entity IDs and columns of the last response, because
+    later ones may only contain what has changed since then.
+    """
+
+    def __init__(self):
+        self.eids = None
+        self.columns = {}
+
+    def decode(self, data):
+        """
+        Return the nested get_data dict for *data*.
+
+        Data without the :data:`mosaik_api.COLUMNAR_KEY` is returned as is.
+        """
+        message = data.pop(mosaik_api.COLUMNAR_KEY, None)
+        if message is None:
+            return data
+
+        eids = self.eids = message.get('eids', self.eids)
+        if 'columns' in message:
+            self.columns = {
+                attr: (range(len(eids)) if idx is None else idx, values)
+                for attr, (idx, values) in message['columns'].items()
+            }
+        else:
+            for attr, (changed, values) in message['delta'].items():
+                column = self.columns[attr][1]
+                for pos, value in zip(changed, values):
+                    column[pos] = value
+
+        for eid in eids:
+            data[eid] = {}
+        for attr, (idx, values) in self.columns.items():
+            for i, value in zip(idx, values):
+                data[eids[i]][attr] = value
+        return data
 
 
 class MosaikRemote:
@@ -804,12 +1199,16 @@ class MosaikRemote:
                 except KeyError:
                     missing[sid][eid].append(attr)
 
-        # Query simulator for data not in the cache
+        # Query simulators for data not in the cache, all at the same time
+        requests = {}
         for sid, attrs in missing.items():
             dep = self.world.sims[sid]
             assert (dep.progress > sim.last_step >= dep.last_step)
-            dep_data = yield dep.proxy.get_data(attrs)
-            for eid, vals in dep_data.items():
+            requests[sid] = dep.proxy.get_data(attrs)
+        yield self.world.env.all_of(list(requests.values()))
+
+        for sid, request in requests.items():
+            for eid, vals in request.value.items():
                 # Maybe there's already an entry for full_id, so we need
                 # to update the dict in that case.
                 data.setdefault(FULL_ID % (sid, eid), {}).update(vals)
@@ -0,0 +1,30 @@
+import os
+import sys
+import types
+
+from simpy.io import select as backend
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def world():
+    """A minimal stand-in for :class:`mosaik.scenario.World` with a server
+    socket that simulators started via *cmd* can connect to."""
+    env = backend.Environment()
+    srv_sock = backend.TCPSocket.server(env, ('127.0.0.1', 0))
+    sim_config = {
+        'ExampleSim': {
+            'cmd': '%(python)s example_sim.py %(addr)s',
+            'cwd': os.path.dirname(os.path.abspath(__file__)),
+            'env': {'PYTHONPATH': ROOT},
+        },
+    }
+    world = types.SimpleNamespace(
+        env=env, srv_sock=srv_sock, sim_config=sim_config, sims={},
+        config={'addr': srv_sock.address, 'start_timeout': 10,
+                'stop_timeout': 10})
+    yield world
+    srv_sock.close()
@@ -0,0 +1,61 @@
+"""
+A simple simulator for the tests. Run it with ``python example_sim.py
+HOST:PORT`` to connect it to mosaik.
+
+If the environment variable ``EXAMPLE_SIM_ANONYMOUS`` is set, it behaves
+like simulators that don't know about parallel startup and never identify
+themselves.
+
+"""
+import os
+
+import mosaik_api
+
+
+META = {
+    'type': 'time-based',
+    'models': {
+        'A': {
+            'public': True,
+            'params': [],
+            'attrs': ['x'],
+        },
+    },
+    'extra_methods': ['get_sid'],
+}
+
+
+class ExampleSim(mosaik_api.Simulator):
+    def __init__(self):
+        super().__init__(META)
+        self.sid = None
+        self.eids = []
+        self.time = None
+
+    def init(self, sid, time_resolution=1., **sim_params):
+        self.sid = sid
+        return self.meta
+
+    def create(self, num, model):
+        start = len(self.eids)
+        entities = [{'eid': 'E%d' % i, 'type': model}
+                    for i in range(start, start + num)]
+        self.eids.extend(e['eid'] for e in entities)
+        return entities
+
+    def step(self, time, inputs, max_advance):
+        self.time = time
+        return time + 1
+
+    def get_sid(self):
+        return self.sid
+
+    def get_data(self, outputs):
+        data = {eid: {'x': self.time} for eid in outputs}
+        return self.columnar_data(data, delta=True)
+
+
+if __name__ == '__main__':
+    if 'EXAMPLE_SIM_ANONYMOUS' in os.environ:
+        os.environ.pop(mosaik_api.SIM_ID_ENV, None)
+    mosaik_api.start_simulation(ExampleSim())
@@ -0,0 +1,104 @@
+import errno
+import os
+
+import pytest
+
+import mosaik_api
+
+
+def test_json_codec():
+    codec = mosaik_api.JSONCodec()
+    data = codec.encode([0, 1, ['step', [0, {'E0': {'x': 1.5}}, 10], {}]])
+    assert type(data) is bytes
+    assert codec.decode(data) == [0, 1, ['step', [0, {'E0': {'x': 1.5}}, 10],
+                                         {}]]
+
+
+def test_msgpack_codec():
+    pytest.importorskip('msgpack')
+    np = pytest.importorskip('numpy')
+    codec = mosaik_api.MsgpackCodec()
+    obj = [1, 2, {'E0': {'x': np.arange(3.), 'y': np.arange(2),
+                         'z': np.float32(.5)}}]
+    assert codec.decode(codec.encode(obj)) == [
+        1, 2, {'E0': {'x': [0., 1., 2.], 'y': [0, 1], 'z': .5}}]
+
+
+@pytest.fixture
+def ring():
+    if 'shm' not in mosaik_api.available_transports():
+        pytest.skip('shared memory is not available')
+    ring = mosaik_api.SharedMemoryRing.create(100)
+    yield ring
+    ring.close()
+
+
+def test_ring_create_no_space(monkeypatch):
+    if ('shm' not in mosaik_api.available_transports() or
+            not hasattr(os, 'posix_fallocate')):
+        pytest.skip('shared memory space cannot be reserved')
+
+    def posix_fallocate(fd, offset, size):
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+    monkeypatch.setattr(mosaik_api.os, 'posix_fallocate', posix_fallocate)
+    before = set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else None
+    pytest.raises(OSError, mosaik_api.SharedMemoryRing.create, 100)
+    if before is not None:
+        assert set(os.listdir('/dev/shm')) <= before  # Segment was unlinked
+
+
+def test_ring_wrap_around(ring):
+    assert ring.capacity == 100
+    assert ring.put(b'a' * 60) == 0
+    assert ring.get(0, 60) == b'a' * 60
+
+    # Payloads don't wrap around but start over at the beginning:
+    assert ring.put(b'b' * 60) == 100
+    assert ring.get(100, 60) == b'b' * 60
+    assert ring.put(b'c' * 30) == 160
+    assert ring.put(b'd' * 50) == 200
+    assert ring.get(160, 30) == b'c' * 30
+    assert ring.get(200, 50) == b'd' * 50
+
+
+def test_ring_full(ring):
+    assert ring.put(b'a' * 60) == 0
+    assert ring.put(b'b' * 60) is None  # Not yet read
+    assert ring.put(b'c' * 101) is None  # Larger than the ring
+    assert ring.put(b'd' * 40) == 60
+    assert ring.get(0, 60) == b'a' * 60
+    assert ring.put(b'e' * 60) == 100
+
+
+def test_shared_memory_packet(ring):
+    from simpy.io import select as backend
+
+    env = backend.Environment()
+    srv_sock = backend.TCPSocket.server(env, ('127.0.0.1', 0))
+    accept = srv_sock.accept()
+    sender = mosaik_api.SharedMemoryPacket(
+        backend.TCPSocket.connection(env, srv_sock.address), threshold=10)
+    receiver = mosaik_api.SharedMemoryPacket(env.run(until=accept),
+                                             threshold=10)
+
+    # Until the rings are attached, everything goes over the socket:
+    env.run(until=sender.write(b'spam' * 10))
+    assert env.run(until=receiver.read()) == b'spam' * 10
+
+    sender.attach(ring, None)
+    receiver.attach(None, ring)
+    # Small payloads, payloads in the ring, and payloads that don't fit
+    # into the ring anymore:
+    payloads = [b'eggs', b'a' * 60, b'b' * 60, b'c' * 50]
+    for payload in payloads:
+        env.run(until=sender.write(payload))
+    assert ring._head == 60
+    for payload in payloads:
+        assert env.run(until=receiver.read()) == payload
+
+    receiver.attach(None, None)  # The ring is closed by the fixture
+    sender.attach(None, None)
+    sender.close()
+    receiver.close()
+    srv_sock.close()
@@ -0,0 +1,181 @@
+import pytest
+
+import mosaik_api
+import simmanager
+
+from example_sim import ExampleSim
+
+
+def run(world, generator):
+    return world.env.run(until=world.env.process(generator))
+
+
+@pytest.fixture(params=['local', 'remote'])
+def sim(request, world):
+    if request.param == 'local':
+        inst = ExampleSim()
+        meta = inst.init('ExampleSim-0', time_resolution=1.)
+        sim = simmanager.LocalProcess('ExampleSim', 'ExampleSim-0', meta,
+                                      inst, world)
+        yield sim
+    else:
+        sim = simmanager.start_proc(world, 'ExampleSim',
+                                    world.sim_config['ExampleSim'],
+                                    'ExampleSim-0', 1., {})
+        yield sim
+        run(world, sim.stop())
+
+
+def test_columnar_decoder_full():
+    decoder = simmanager.ColumnarDecoder()
+    key = mosaik_api.COLUMNAR_KEY
+    assert decoder.decode({'time': 3, key: {
+        'eids': ['E0', 'E1', 'E2'],
+        'columns': {'x': [None, [1, 2, 3]], 'y': [[1], [4]]},
+    }}) == {
+        'time': 3,
+        'E0': {'x': 1},
+        'E1': {'x': 2, 'y': 4},
+        'E2': {'x': 3},
+    }
+
+    # The entity IDs are only sent again when they change:
+    assert decoder.decode({key: {
+        'columns': {'x': [[0, 2], [5, 6]]},
+    }}) == {'E0': {'x': 5}, 'E1': {}, 'E2': {'x': 6}}
+    assert decoder.decode({key: {
+        'eids': ['E3'],
+        'columns': {'x': [None, [7]]},
+    }}) == {'E3': {'x': 7}}
+
+
+def test_columnar_decoder_delta():
+    decoder = simmanager.ColumnarDecoder()
+    key = mosaik_api.COLUMNAR_KEY
+    decoder.decode({key: {
+        'eids': ['E0', 'E1', 'E2'],
+        'columns': {'x': [None, [1, 2, 3]], 'y': [[1], [4]]},
+    }})
+
+    # Positions in the delta refer to the column, not to the entity list:
+    assert decoder.decode({key: {
+        'delta': {'x': [[2], [30]], 'y': [[0], [40]]},
+    }}) == {'E0': {'x': 1}, 'E1': {'x': 2, 'y': 40}, 'E2': {'x': 30}}
+    assert decoder.decode({key: {'delta': {}}}) == {
+        'E0': {'x': 1}, 'E1': {'x': 2, 'y': 40}, 'E2': {'x': 30}}
+
+
+def test_columnar_decoder_plain_data():
+    decoder = simmanager.ColumnarDecoder()
+    data = {'E0': {'x': 1}, 'time': 2}
+    assert decoder.decode(data) is data
+
+
+@pytest.mark.parametrize('delta', [False, True])
+def test_columnar_data_round_trip(delta):
+    sim = mosaik_api.Simulator({})
+    decoder = simmanager.ColumnarDecoder()
+    codec = mosaik_api.JSONCodec()
+    steps = [
+        {'E0': {'x': 1, 'y': 2}, 'E1': {'x': 1}},
+        {'E0': {'x': 1, 'y': 3}, 'E1': {'x': 1}},
+        {'E0': {'x': 1, 'y': 3}, 'E1': {'x': 1}, 'time': 4},
+        {'E0': {'x': 2}, 'E1': {'x': 1}},  # Other attributes
+        {'E0': {'x': 2}, 'E1': {'x': 1}, 'E2': {}},  # Other entities
+        {'E0': {'x': 3}, 'E1': {'x': 1}, 'E2': {}},
+    ]
+    for data in steps:
+        message = sim.columnar_data(data, delta=delta)
+        assert decoder.decode(codec.decode(codec.encode(message))) == data
+    # Only the changed value was sent:
+    if delta:
+        assert message[mosaik_api.COLUMNAR_KEY] == {'delta': {'x': [[0], [3]]}}
+
+
+@pytest.mark.parametrize('offered, wanted, codec', [
+    (['msgpack', 'json'], None, 'msgpack'),
+    (['msgpack', 'json'], 'json', 'json'),
+    (['msgpack', 'json'], 'msgpack', 'msgpack'),
+    (['json'], 'msgpack', 'json'),
+    (['spam', 'json'], None, 'json'),
+    ([], None, 'json'),
+])
+def test_select_codec(monkeypatch, offered, wanted, codec):
+    monkeypatch.setattr(mosaik_api, 'available_codecs',
+                        lambda: ['msgpack', 'json'])
+    assert simmanager.select_codec(offered, wanted) == codec
+
+
+def test_select_codec_unavailable(monkeypatch):
+    monkeypatch.setattr(mosaik_api, 'available_codecs', lambda: ['json'])
+    assert simmanager.select_codec(['msgpack', 'json']) == 'json'
+
+
+@pytest.mark.parametrize('codec', [None, 'json', 'msgpack'])
+def test_start_proc_codec(world, codec):
+    if codec != 'json':
+        pytest.importorskip('msgpack')
+    config = world.sim_config['ExampleSim']
+    if codec is not None:
+        config['codec'] = codec
+    sim = simmanager.start_proc(world, 'ExampleSim', config, 'ExampleSim-0',
+                                1., {})
+    assert 'codecs' not in sim.meta
+    assert sim._rpc_con.message.codec.name == (codec or 'msgpack')
+
+    def scenario():
+        yield sim.proxy.create(1, 'A')
+        yield sim.proxy.step(0, {'E0': {'x': {'src.0': 1.5}}}, 10)
+        assert (yield sim.proxy.get_data({'E0': ['x']})) == {
+            'E0': {'x': 0}}
+        yield from sim.stop()
+
+    run(world, scenario())
+
+
+def test_batch_get_data_columnar(world, sim):
+    outputs = {'E0': ['x'], 'E1': ['x']}
+
+    def data(x):
+        return {'E0': {'x': x}, 'E1': {'x': x}}
+
+    def scenario():
+        yield sim.proxy.create(2, 'A')
+        assert (yield sim.proxy.step_get_data(2, {}, 10, outputs)) == (
+            3, data(2))
+        assert (yield sim.proxy.batch([
+            ['step', [5, {}, 10], {}],
+            ['get_data', [outputs], {}],
+        ])) == [6, data(5)]
+        # Only the changes since the batch are sent now:
+        assert (yield sim.proxy.get_data(outputs)) == data(5)
+
+    run(world, scenario())
+
+
+def test_start_parallel(world):
+    config = world.sim_config['ExampleSim']
+    world.sim_config['Parallel'] = dict(config, parallel=True)
+    # Simulators using an older mosaik API don't identify themselves and
+    # are started one after another:
+    world.sim_config['Anonymous'] = dict(
+        config, env=dict(config['env'], EXAMPLE_SIM_ANONYMOUS='1'))
+    sims = [
+        ('Parallel', 'Parallel-0', {}),
+        ('Anonymous', 'Anonymous-0', {}),
+        ('Parallel', 'Parallel-1', {}),
+        ('ExampleSim', 'ExampleSim-0', {}),
+        ('Parallel', 'Parallel-2', {}),
+    ]
+    proxies = simmanager.start_parallel(world, sims, 1.)
+    assert list(proxies) == [sim_id for _, sim_id, _ in sims]
+
+    def scenario():
+        for sim_id, sim in proxies.items():
+            assert isinstance(sim, simmanager.RemoteProcess)
+            assert sim.sid == sim_id
+            assert (yield sim.proxy.get_sid()) == sim_id
+        for sim in proxies.values():
+            yield from sim.stop()
+
+    run(world, scenario())